@@ -43,4 +43,8 @@ def _draw(strokes, lines, filename, stroke_colors=None, stroke_widths=None):
 
         initial_coord[1] -= line_height
 
-    dwg.save()
+    # filename may also be a writable file-like object (e.g. io.StringIO)
+    if hasattr(filename, 'write'):
+        dwg.write(filename)
+    else:
+        dwg.save()
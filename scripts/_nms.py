@@ -0,0 +1,79 @@
+"""
+Box Filtering Kernels
+Greedy NMS compiled with Numba for post-detection deduplication on the CPU
+
+numba is optional (pip install .[fast]); without it the same kernels run as
+plain Python, which is fine for the few hundred boxes on a page.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in so the kernels still run (slowly) without numba."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+
+
+# Serial on purpose: for a few hundred boxes, thread fork/join costs more than the work
+@njit(cache=True)
+def box_areas(boxes: np.ndarray) -> np.ndarray:
+    """Areas of (N, 4) xyxy boxes."""
+    n = boxes.shape[0]
+    areas = np.empty(n, dtype=np.float64)
+    for i in range(n):
+        w = max(0.0, boxes[i, 2] - boxes[i, 0])
+        h = max(0.0, boxes[i, 3] - boxes[i, 1])
+        areas[i] = w * h
+    return areas
+
+
+@njit(cache=True)
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_thr: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression.
+
+    Args:
+        boxes: (N, 4) xyxy boxes
+        scores: (N,) confidence scores
+        iou_thr: Boxes overlapping a kept box by more than this IoU are dropped
+
+    Returns:
+        Indices of kept boxes, highest score first
+    """
+    n = boxes.shape[0]
+    areas = box_areas(boxes)
+    order = np.argsort(-scores)
+    suppressed = np.zeros(n, dtype=np.bool_)
+    keep = np.empty(n, dtype=np.int64)
+    num_kept = 0
+
+    for oi in range(n):
+        i = order[oi]
+        if suppressed[i]:
+            continue
+        keep[num_kept] = i
+        num_kept += 1
+
+        for oj in range(oi + 1, n):
+            j = order[oj]
+            if suppressed[j]:
+                continue
+
+            xx1 = max(boxes[i, 0], boxes[j, 0])
+            yy1 = max(boxes[i, 1], boxes[j, 1])
+            xx2 = min(boxes[i, 2], boxes[j, 2])
+            yy2 = min(boxes[i, 3], boxes[j, 3])
+            inter = max(0.0, xx2 - xx1) * max(0.0, yy2 - yy1)
+            union = areas[i] + areas[j] - inter
+
+            if union > 0 and inter / union > iou_thr:
+                suppressed[j] = True
+
+    return keep[:num_kept]
@@ -8,7 +8,7 @@ import sys
 import json
 import argparse
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterator
 from collections import defaultdict
 
 import numpy as np
@@ -301,16 +301,57 @@ def load_yolo_labels(label_dir: Path) -> Dict[str, List[Dict]]:
     return labels
 
 
+def iter_predictions(predictions_path: Path) -> Iterator[Tuple[str, Dict]]:
+    """
+    Yield (image_name, per-image result) pairs from run_inference output.
+    
+    Accepts the all_detections.ndjson stream (or a directory containing it),
+    a directory of per-image JSON files (--legacy-json), or a single JSON
+    file (combined all_detections.json or one image's result).
+    """
+    if predictions_path.is_dir():
+        json_files = sorted(predictions_path.glob('*.json'))
+        ndjson_path = predictions_path / 'all_detections.ndjson'
+        if json_files or not ndjson_path.exists():
+            for json_file in json_files:
+                yield from iter_predictions(json_file)
+            return
+        predictions_path = ndjson_path
+    
+    if predictions_path.suffix == '.ndjson':
+        with open(predictions_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                # Header (model/config) and summary lines carry no detections
+                if 'detections' in record:
+                    yield Path(record['image_path']).stem, record
+        return
+    
+    with open(predictions_path, 'r', encoding='utf-8') as f:
+        pred_data = json.load(f)
+    
+    if 'images' in pred_data:
+        for record in pred_data['images']:
+            yield Path(record['image_path']).stem, record
+    elif 'detections' in pred_data:
+        yield predictions_path.stem, pred_data
+
+
 def evaluate_from_files(
-    predictions_dir: Path,
+    predictions_path: Path,
     ground_truth_dir: Path,
 ) -> Dict:
     """
-    Evaluate detection and OCR from JSON files.
+    Evaluate detection and OCR from run_inference results.
     
     Expects:
-    - predictions_dir: Directory with detection JSON files
+    - predictions_path: all_detections.ndjson, a directory containing it, or
+      a directory of per-image detection JSON files
     - ground_truth_dir: Directory with ground truth labels (YOLO format)
+    
+    Returns an empty dict if no predictions were found.
     """
     results = {
         'detection': {},
@@ -324,12 +365,10 @@ def evaluate_from_files(
     ocr_gts = []
     
     gt_labels = load_yolo_labels(ground_truth_dir)
+    num_predictions = 0
     
-    for json_file in predictions_dir.glob('*.json'):
-        with open(json_file, 'r') as f:
-            pred_data = json.load(f)
-        
-        image_name = json_file.stem
+    for image_name, pred_data in iter_predictions(predictions_path):
+        num_predictions += 1
         
         # Detection evaluation
         if image_name in gt_labels:
@@ -345,6 +384,12 @@ def evaluate_from_files(
                 ocr_preds.append(det['ocr_text'])
                 ocr_gts.append(det['ground_truth_text'])
     
+    if num_predictions == 0:
+        print(f"❌ No predictions found in {predictions_path}")
+        return {}
+    if not all_preds:
+        print(f"⚠️  None of the {num_predictions} predicted images have ground truth labels")
+    
     # Calculate detection metrics
     if all_preds and all_gts:
         results['detection'] = calculate_map(all_preds, all_gts)
@@ -398,7 +443,8 @@ def main():
     
     # Input options
     parser.add_argument('--predictions', '-p', type=str,
-                       help='Path to predictions directory (JSON files)')
+                       help='run_inference output: all_detections.ndjson, its directory, '
+                            'or a directory of per-image JSON files')
     parser.add_argument('--ground-truth', '-g', type=str,
                        help='Path to ground truth directory (YOLO labels)')
     
@@ -476,18 +522,20 @@ def main():
     
     # File-based evaluation
     if args.predictions and args.ground_truth:
-        pred_dir = Path(args.predictions)
+        pred_path = Path(args.predictions)
         gt_dir = Path(args.ground_truth)
         
-        if not pred_dir.exists():
-            print(f"❌ Predictions directory not found: {pred_dir}")
+        if not pred_path.exists():
+            print(f"❌ Predictions not found: {pred_path}")
             sys.exit(1)
         
         if not gt_dir.exists():
             print(f"❌ Ground truth directory not found: {gt_dir}")
             sys.exit(1)
         
-        results = evaluate_from_files(pred_dir, gt_dir)
+        results = evaluate_from_files(pred_path, gt_dir)
+        if not results:
+            sys.exit(1)
     
     # Direct OCR evaluation
     if args.ocr_pred and args.ocr_gt:
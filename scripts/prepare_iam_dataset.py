@@ -16,16 +16,49 @@ After registration, you'll receive download credentials via email.
 
 import os
 import sys
+import struct
+import shutil
+import tarfile
 import argparse
+import subprocess
 import requests
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional, Iterator, Union
 import xml.etree.ElementTree as ET
 from tqdm import tqdm
-import cv2
 import numpy as np
+import xxhash
 import yaml
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from scripts.download_real_datasets import DOWNLOAD_CHUNK_SIZE
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def read_png_size(img_path: Path) -> Optional[Tuple[int, int]]:
+    """
+    Read (width, height) from a PNG's IHDR chunk without decoding pixels.
+    
+    IHDR is always the first chunk, so width/height are the two big-endian
+    uint32s at byte offsets 16 and 20. Returns None for non-PNG/truncated files.
+    """
+    with open(img_path, 'rb') as f:
+        head = f.read(24)
+    
+    if len(head) < 24 or head[:8] != PNG_SIGNATURE or head[12:16] != b'IHDR':
+        return None
+    
+    w, h = struct.unpack('>II', head[16:24])
+    return w, h
+
 
 def download_with_auth(url: str, dest: Path, username: str, password: str):
     """Download file with HTTP basic authentication."""
@@ -50,7 +83,7 @@ def download_with_auth(url: str, dest: Path, username: str, password: str):
         unit_scale=True,
         unit_divisor=1024,
     ) as bar:
-        for chunk in response.iter_content(chunk_size=8192):
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
             size = f.write(chunk)
             bar.update(size)
     
@@ -93,10 +126,35 @@ def download_iam_dataset(data_dir: Path, username: str, password: str):
     return True
 
 
+def extract_tgz(archive_path: Path, dest_dir: Path):
+    """
+    Extract a .tgz archive into dest_dir.
+    
+    Uses pigz (parallel gzip) piped into tar when both are on PATH, which is
+    several times faster than Python's single-threaded gzip reader for the
+    multi-GB IAM archives. Falls back to tarfile otherwise.
+    """
+    pigz = shutil.which('pigz')
+    tar = shutil.which('tar')
+    
+    if pigz and tar:
+        with subprocess.Popen([pigz, '-dc', str(archive_path)], stdout=subprocess.PIPE) as unzip:
+            subprocess.run([tar, '-x', '-C', str(dest_dir)], stdin=unzip.stdout, check=True)
+            unzip.stdout.close()
+        if unzip.returncode != 0:
+            raise subprocess.CalledProcessError(unzip.returncode, unzip.args)
+        return
+    
+    with tarfile.open(archive_path, 'r:gz') as tar_file:
+        # 'data' filter rejects absolute paths / links outside dest_dir
+        if hasattr(tarfile, 'data_filter'):
+            tar_file.extractall(dest_dir, filter='data')
+        else:
+            tar_file.extractall(dest_dir)
+
+
 def extract_archives(data_dir: Path):
     """Extract downloaded tar.gz archives."""
-    import tarfile
-    
     print("\n" + "="*60)
     print(" Extracting Archives")
     print("="*60)
@@ -117,8 +175,7 @@ def extract_archives(data_dir: Path):
             continue
         
         print(f"Extracting: {archive_name}")
-        with tarfile.open(archive_path, 'r:gz') as tar:
-            tar.extractall(data_dir)
+        extract_tgz(archive_path, data_dir)
         
         print(f"✅ Extracted: {archive_name}")
     
@@ -166,6 +223,91 @@ def parse_iam_lines_file(lines_file: Path) -> Dict[str, Dict]:
     return annotations
 
 
+def compute_train_mask(ids: List[str], train_ratio: float) -> np.ndarray:
+    """
+    Deterministic train/val assignment for a list of sample IDs.
+    
+    Hashes every ID with xxh3 (stable across runs, unlike the builtin hash())
+    and thresholds all hashes at once, so the conversion loop never branches
+    on the subset.
+    """
+    h = xxhash.xxh3_64
+    hashes = np.fromiter((h(i.encode()).intdigest() for i in ids), dtype=np.uint64, count=len(ids))
+    return (hashes % 10000) < int(train_ratio * 10000)
+
+
+def scantree(root: Union[str, Path], suffix: str = '.png') -> Iterator[os.DirEntry]:
+    """Recursively yield files under root ending in suffix, using os.scandir."""
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scantree(entry.path, suffix)
+            elif entry.name.endswith(suffix):
+                yield entry
+
+
+def iam_form_id(sample_id: str) -> str:
+    """Form ID of an IAM line/word ID (e.g. a01-000u-00 -> a01-000u)."""
+    return '-'.join(sample_id.split('-')[:2])
+
+
+def convert_iam_sample(img_path: Path, ann: Dict, subset: str, output_dir: Path) -> Optional[Dict]:
+    """
+    Copy one IAM image into the YOLO tree and write its label file.
+    
+    Outputs are sharded by form ID (images/<subset>/<form_id>/...) so no single
+    directory holds tens of thousands of files; the directories must already exist.
+    Returns the OCR label entry, or None if the image could not be read.
+    """
+    line_id = img_path.stem
+    form_id = iam_form_id(line_id)
+    
+    # Read dimensions from the PNG header (no pixel decode)
+    size = read_png_size(img_path)
+    if size is None:
+        return None
+    
+    w, h = size
+    
+    # Copy image as-is (PNG is lossless, no need to re-encode)
+    out_img_path = output_dir / 'images' / subset / form_id / f"{line_id}.png"
+    shutil.copyfile(img_path, out_img_path)
+    
+    # Create YOLO label (single box covering the whole line)
+    # IAM boxes are absolute (x, y, w, h), convert to YOLO (cx, cy, w, h) normalized
+    x, y, box_w, box_h = ann['box']
+    
+    # Handle edge cases where box extends beyond image
+    x = max(0, min(x, w-1))
+    y = max(0, min(y, h-1))
+    box_w = min(box_w, w - x)
+    box_h = min(box_h, h - y)
+    
+    # Convert to YOLO format
+    x_center = (x + box_w / 2) / w
+    y_center = (y + box_h / 2) / h
+    width_norm = box_w / w
+    height_norm = box_h / h
+    
+    # Clamp to [0, 1]
+    x_center = max(0, min(1, x_center))
+    y_center = max(0, min(1, y_center))
+    width_norm = max(0, min(1, width_norm))
+    height_norm = max(0, min(1, height_norm))
+    
+    # Write YOLO label
+    label_path = output_dir / 'labels' / subset / form_id / f"{line_id}.txt"
+    with open(label_path, 'w') as f:
+        f.write(f"0 {x_center:.6f} {y_center:.6f} {width_norm:.6f} {height_norm:.6f}\n")
+    
+    # OCR label
+    return {
+        'image': f"{subset}/{form_id}/{line_id}.png",
+        'text': ann['text'],
+        'box': [x, y, x + box_w, y + box_h],
+    }
+
+
 def convert_iam_to_yolo(
     data_dir: Path,
     output_dir: Path,
@@ -200,94 +342,60 @@ def convert_iam_to_yolo(
         print(f"❌ Images directory not found: {images_dir}")
         return False
     
-    # Create output directories
+    (output_dir / 'ocr_labels').mkdir(parents=True, exist_ok=True)
+    
+    # Stream the directory walk, keeping only images with an annotation
+    found = 0
+    annotated = []
+    for entry in scantree(images_dir):
+        found += 1
+        if entry.name[:-len('.png')] in annotations:
+            annotated.append(Path(entry.path))
+    print(f"Found {found} images")
+    
+    # Split once up front
+    all_images = np.array(annotated, dtype=object)
+    is_train_mask = compute_train_mask([p.stem for p in all_images], train_ratio)
+    subsets = (('train', all_images[is_train_mask]), ('val', all_images[~is_train_mask]))
+    
+    # Create every per-form output directory once, outside the conversion loop
+    shard_dirs = {
+        output_dir / kind / subset / iam_form_id(p.stem)
+        for subset, subset_images in subsets
+        for p in subset_images
+        for kind in ('images', 'labels')
+    }
     for subset in ['train', 'val']:
         (output_dir / 'images' / subset).mkdir(parents=True, exist_ok=True)
         (output_dir / 'labels' / subset).mkdir(parents=True, exist_ok=True)
-    
-    (output_dir / 'ocr_labels').mkdir(parents=True, exist_ok=True)
-    
-    # Process all images
-    all_images = list(images_dir.rglob('*.png'))
-    print(f"Found {len(all_images)} images")
+    for shard_dir in shard_dirs:
+        shard_dir.mkdir(parents=True, exist_ok=True)
     
     ocr_labels = []
-    train_count = 0
-    val_count = 0
+    counts = {'train': 0, 'val': 0}
     
-    for img_path in tqdm(all_images, desc="Converting"):
-        # Get line ID from filename (e.g., a01-000u-00.png -> a01-000u-00)
-        line_id = img_path.stem
-        
-        # Get annotation
-        if line_id not in annotations:
-            continue
-        
-        ann = annotations[line_id]
-        
-        # Read image to get dimensions
-        img = cv2.imread(str(img_path))
-        if img is None:
-            continue
-        
-        h, w = img.shape[:2]
-        
-        # Decide train/val split (deterministic based on ID)
-        is_train = hash(line_id) % 100 < (train_ratio * 100)
-        subset = 'train' if is_train else 'val'
-        
-        # Copy image
-        out_img_path = output_dir / 'images' / subset / f"{line_id}.jpg"
-        cv2.imwrite(str(out_img_path), img)
-        
-        # Create YOLO label (single box covering the whole line)
-        # IAM boxes are absolute (x, y, w, h), convert to YOLO (cx, cy, w, h) normalized
-        x, y, box_w, box_h = ann['box']
-        
-        # Handle edge cases where box extends beyond image
-        x = max(0, min(x, w-1))
-        y = max(0, min(y, h-1))
-        box_w = min(box_w, w - x)
-        box_h = min(box_h, h - y)
-        
-        # Convert to YOLO format
-        x_center = (x + box_w / 2) / w
-        y_center = (y + box_h / 2) / h
-        width_norm = box_w / w
-        height_norm = box_h / h
-        
-        # Clamp to [0, 1]
-        x_center = max(0, min(1, x_center))
-        y_center = max(0, min(1, y_center))
-        width_norm = max(0, min(1, width_norm))
-        height_norm = max(0, min(1, height_norm))
-        
-        # Write YOLO label
-        label_path = output_dir / 'labels' / subset / f"{line_id}.txt"
-        with open(label_path, 'w') as f:
-            f.write(f"0 {x_center:.6f} {y_center:.6f} {width_norm:.6f} {height_norm:.6f}\n")
-        
-        # Save OCR label
-        ocr_labels.append({
-            'image': f"{subset}/{line_id}.jpg",
-            'text': ann['text'],
-            'box': [x, y, x + box_w, y + box_h],
-        })
-        
-        if is_train:
-            train_count += 1
-        else:
-            val_count += 1
+    for subset, subset_images in subsets:
+        for img_path in tqdm(subset_images, desc=f"Converting {subset}"):
+            ocr_label = convert_iam_sample(img_path, annotations[img_path.stem], subset, output_dir)
+            if ocr_label is None:
+                continue
+            ocr_labels.append(ocr_label)
+            counts[subset] += 1
     
     print(f"\n✅ Converted:")
-    print(f"   Training: {train_count} images")
-    print(f"   Validation: {val_count} images")
+    print(f"   Training: {counts['train']} images")
+    print(f"   Validation: {counts['val']} images")
     
-    # Save OCR labels
-    import json
+    # Save OCR labels (orjson is much faster for the ~115k word-level entries)
     ocr_file = output_dir / 'ocr_labels' / 'labels.json'
-    with open(ocr_file, 'w', encoding='utf-8') as f:
-        json.dump(ocr_labels, f, indent=2, ensure_ascii=False)
+    if ORJSON_AVAILABLE:
+        ocr_file.write_bytes(
+            orjson.dumps(ocr_labels, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+        )
+    else:
+        import json
+        with open(ocr_file, 'w', encoding='utf-8') as f:
+            json.dump(ocr_labels, f, indent=2, ensure_ascii=False)
     
     print(f"✅ OCR labels saved: {ocr_file}")
     
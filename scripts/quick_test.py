@@ -11,6 +11,8 @@ import shutil
 import argparse
 from pathlib import Path
 from datetime import datetime
+from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import torch
 
@@ -68,7 +70,7 @@ def create_sample_dataset(output_dir: Path, num_samples: int = 100):
     train_dataset, test_dataset = download_emnist(data_dir, 'byclass')
     char_mapping = get_char_mapping('byclass')
     
-    # Create YOLO format dataset
+    # Create YOLO format dataset (val is rendered from the held-out EMNIST test split)
     num_train = max(int(num_samples * 0.8), 10)
     num_val = max(int(num_samples * 0.2), 5)
     
@@ -84,6 +86,11 @@ def create_sample_dataset(output_dir: Path, num_samples: int = 100):
         chars_per_doc=20,
     )
     
+    # Earlier quick-test versions linked train documents into val; drop them
+    for kind, ext in (('images', 'jpg'), ('labels', 'txt')):
+        for stale in (output_dir / kind / 'val').glob(f"doc_train_*.{ext}"):
+            stale.unlink()
+    
     create_data_yaml(output_dir)
     
     # Verify
@@ -188,20 +195,33 @@ def test_inference(model_path: Path, data_dir: Path):
     return True
 
 
-def test_ocr():
-    """Test OCR component."""
+def load_trocr(model_name: str = "microsoft/trocr-base-handwritten"):
+    """
+    Download and load TrOCR on the CPU.
+    
+    Touches no GPU memory, so it can run in the background while the
+    detector trains; test_ocr moves the model to the GPU afterwards.
+    """
+    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+    
+    processor = TrOCRProcessor.from_pretrained(model_name)
+    model = VisionEncoderDecoderModel.from_pretrained(model_name)
+    return processor, model
+
+
+def test_ocr(trocr_future: Optional[Future] = None):
+    """Test OCR component (using a TrOCR preloaded by load_trocr, if given)."""
     print_header("5. Testing OCR")
     
     try:
-        from transformers import TrOCRProcessor, VisionEncoderDecoderModel
         from PIL import Image
         import numpy as np
         
-        print("Loading TrOCR (this may take a moment on first run)...")
-        
-        model_name = "microsoft/trocr-base-handwritten"
-        processor = TrOCRProcessor.from_pretrained(model_name)
-        model = VisionEncoderDecoderModel.from_pretrained(model_name)
+        if trocr_future is not None:
+            processor, model = trocr_future.result()
+        else:
+            print("Loading TrOCR (this may take a moment on first run)...")
+            processor, model = load_trocr()
         
         if torch.cuda.is_available():
             model = model.half().cuda()
@@ -312,6 +332,11 @@ def run_quick_test(
     vram_mode = check_environment()
     results['environment'] = vram_mode != 'cpu'
     
+    # 5. The TrOCR download/load is CPU-only, so overlap it with dataset creation
+    # and training; the GPU part of the OCR test runs after training finishes
+    ocr_executor = ThreadPoolExecutor(max_workers=1)
+    trocr_future = ocr_executor.submit(load_trocr)
+    
     # 2. Create sample dataset
     data_dir = Path('data/quick_test')
     try:
@@ -346,10 +371,12 @@ def run_quick_test(
     
     # 5. Test OCR
     try:
-        results['ocr'] = test_ocr()
+        results['ocr'] = test_ocr(trocr_future)
     except Exception as e:
         print(f"❌ OCR test failed: {e}")
         results['ocr'] = False
+    finally:
+        ocr_executor.shutdown()
     
     # 6. Test full pipeline
     if results.get('training') and results.get('ocr'):
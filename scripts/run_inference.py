@@ -7,24 +7,136 @@ import os
 import sys
 import json
 import argparse
+import importlib.util
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Deque, List, Dict, Optional, Tuple
+from dataclasses import dataclass
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import cv2
 import numpy as np
 import torch
+from PIL import Image
 from ultralytics import YOLO
 from tqdm import tqdm
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
-def load_model(model_path: str, device: str = '0') -> YOLO:
-    """Load YOLOv8 model."""
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    # PyTurboJPEG missing, or libturbojpeg not found
+    _turbo_jpeg = None
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from scripts._nms import nms
+
+# Inference-only script: no autograd bookkeeping anywhere
+torch.set_grad_enabled(False)
+
+
+@dataclass
+class Detections:
+    """Detections for one image, stored column-wise (one array per field)."""
+    boxes: np.ndarray  # (N, 4) int32 xyxy
+    conf: np.ndarray   # (N,) float32
+    cls: np.ndarray    # (N,) int32
+    
+    def __len__(self) -> int:
+        return len(self.boxes)
+    
+    def to_dicts(self, names: Dict[int, str]) -> List[Dict]:
+        """Expand to one dictionary per detection (JSON output format)."""
+        # Vectorized math, then one bulk conversion to plain Python ints/floats
+        boxes = self.boxes.tolist()
+        conf = self.conf.astype(np.float64).round(4).tolist()
+        cls = self.cls.tolist()
+        centers = ((self.boxes[:, :2] + self.boxes[:, 2:]) // 2).tolist()
+        sizes = (self.boxes[:, 2:] - self.boxes[:, :2]).tolist()
+        
+        return [
+            {
+                'id': i,
+                'box': boxes[i],
+                'confidence': conf[i],
+                'class': cls[i],
+                'class_name': names[cls[i]],
+                'center': centers[i],
+                'width': sizes[i][0],
+                'height': sizes[i][1],
+            }
+            for i in range(len(self))
+        ]
+
+
+def tensorrt_available() -> bool:
+    """Check whether TensorRT is installed (needed for .engine export)."""
+    return importlib.util.find_spec('tensorrt') is not None
+
+
+def load_model(
+    model_path: str,
+    device: str = '0',
+    imgsz: int = 640,
+    batch: int = 16,
+    use_engine: bool = True,
+) -> YOLO:
+    """
+    Load YOLOv8 model.
+    
+    TensorRT FP16 is the intended deployment path: a .pt checkpoint is exported
+    once to a .engine file next to the weights (dynamic batch up to `batch`)
+    and the engine is loaded instead. Falls back to the PyTorch checkpoint on
+    CPU or when tensorrt is not installed. Delete the cached .engine after
+    changing imgsz/batch.
+    """
+    path = Path(model_path)
+    
+    if use_engine and path.suffix == '.pt' and device != 'cpu':
+        if tensorrt_available():
+            engine_path = path.with_suffix('.engine')
+            if not engine_path.exists():
+                print(f"Exporting TensorRT FP16 engine: {engine_path}")
+                YOLO(str(path)).export(
+                    format='engine',
+                    imgsz=imgsz,
+                    half=True,
+                    device=device,
+                    dynamic=True,
+                    batch=batch,
+                )
+            model_path = str(engine_path)
+        else:
+            print("⚠️  tensorrt not installed, using PyTorch weights")
+    
     print(f"Loading model: {model_path}")
     model = YOLO(model_path)
     return model
 
 
+def warmup_model(model: YOLO, imgsz: int = 640, device: str = '0', batch: int = 1):
+    """
+    Run dummy batches through the model so engine deserialization, cuDNN
+    autotuning and CUDA context setup are not billed to the first real image.
+    """
+    dummy = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8)] * batch
+    
+    with torch.inference_mode():
+        for _ in range(2):
+            model.predict(source=dummy, imgsz=imgsz, device=device, batch=batch, verbose=False)
+    
+    if torch.cuda.is_available() and device != 'cpu':
+        torch.cuda.synchronize()
+
+
 def run_detection(
     model: YOLO,
     image_path: Path,
@@ -32,12 +144,12 @@ def run_detection(
     iou_threshold: float = 0.45,
     imgsz: int = 640,
     device: str = '0',
-) -> Tuple[List[Dict], np.ndarray]:
+) -> Tuple[Detections, np.ndarray]:
     """
     Run detection on a single image.
     
     Returns:
-        detections: List of detection dictionaries
+        detections: Detections (column arrays)
         image: Original image array
     """
     # Load image
@@ -48,110 +160,191 @@ def run_detection(
     h, w = image.shape[:2]
     
     # Run inference
-    results = model.predict(
-        source=image,
-        conf=conf_threshold,
-        iou=iou_threshold,
-        imgsz=imgsz,
-        device=device,
-        verbose=False,
-    )[0]
-    
-    # Parse results
-    detections = []
-    boxes = results.boxes
+    with torch.inference_mode():
+        results = model.predict(
+            source=image,
+            conf=conf_threshold,
+            iou=iou_threshold,
+            imgsz=imgsz,
+            device=device,
+            verbose=False,
+        )[0]
+    
+    return parse_detections(results), image
+
+
+def run_detection_batch(
+    model: YOLO,
+    images: List[np.ndarray],
+    conf_threshold: float = 0.25,
+    iou_threshold: float = 0.45,
+    imgsz: int = 640,
+    device: str = '0',
+) -> List[Detections]:
+    """
+    Run detection on a batch of already-loaded images in one forward pass.
     
-    for i, box in enumerate(boxes):
-        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-        conf = float(box.conf[0].cpu().numpy())
-        cls = int(box.cls[0].cpu().numpy())
-        
-        detection = {
-            'id': i,
-            'box': [int(x1), int(y1), int(x2), int(y2)],
-            'confidence': round(conf, 4),
-            'class': cls,
-            'class_name': model.names[cls],
-            'center': [int((x1 + x2) / 2), int((y1 + y2) / 2)],
-            'width': int(x2 - x1),
-            'height': int(y2 - y1),
-        }
-        detections.append(detection)
+    Returns:
+        One Detections per input image
+    """
+    with torch.inference_mode():
+        results = model.predict(
+            source=images,
+            conf=conf_threshold,
+            iou=iou_threshold,
+            imgsz=imgsz,
+            device=device,
+            batch=len(images),
+            verbose=False,
+        )
     
-    return detections, image
+    return [parse_detections(r) for r in results]
+
+
+def parse_detections(results) -> Detections:
+    """Convert a single Ultralytics Results object to column arrays."""
+    boxes = results.boxes
+    
+    # One device->host copy per field instead of three per box
+    return Detections(
+        boxes=boxes.xyxy.cpu().numpy().astype(np.int32),
+        conf=boxes.conf.cpu().numpy(),
+        cls=boxes.cls.cpu().numpy().astype(np.int32),
+    )
 
 
 def crop_detections(
     image: np.ndarray,
-    detections: List[Dict],
+    detections: Detections,
     padding: int = 5,
     min_size: int = 10,
-) -> List[Tuple[np.ndarray, Dict]]:
+    nms_iou: Optional[float] = None,
+) -> List[Tuple[np.ndarray, int]]:
     """
     Crop detected regions from image.
     
     Args:
         image: Original image
-        detections: List of detection dictionaries
+        detections: Detections for this image
         padding: Padding around crops (pixels)
         min_size: Minimum crop size
-        
+        nms_iou: If set, drop boxes overlapping a higher-scoring box by more
+            than this IoU before cropping (class-agnostic, Numba kernel)
+    
     Returns:
-        List of (crop_image, detection) tuples
+        List of (crop_image, detection_index) tuples; crops are views into image
     """
     h, w = image.shape[:2]
-    crops = []
     
-    for det in detections:
-        x1, y1, x2, y2 = det['box']
-        
-        # Add padding
-        x1 = max(0, x1 - padding)
-        y1 = max(0, y1 - padding)
-        x2 = min(w, x2 + padding)
-        y2 = min(h, y2 + padding)
-        
-        # Check minimum size
-        if (x2 - x1) < min_size or (y2 - y1) < min_size:
-            continue
-        
-        crop = image[y1:y2, x1:x2].copy()
-        crops.append((crop, det))
+    # Pad, clip and size-filter all boxes at once
+    padded = detections.boxes + np.array([-padding, -padding, padding, padding], dtype=np.int32)
+    padded[:, 0::2] = np.clip(padded[:, 0::2], 0, w)
+    padded[:, 1::2] = np.clip(padded[:, 1::2], 0, h)
+    sizes = padded[:, 2:] - padded[:, :2]
+    keep = np.flatnonzero((sizes >= min_size).all(axis=1))
+    
+    if nms_iou is not None and len(keep) > 1:
+        kept = nms(detections.boxes[keep], detections.conf[keep], nms_iou)
+        keep = np.sort(keep[kept])
+    
+    # Views, not copies: the source image outlives the crops
+    return [
+        (image[y1:y2, x1:x2], i)
+        for i, (x1, y1, x2, y2) in zip(keep.tolist(), padded[keep].tolist())
+    ]
+
+
+def write_jpeg(path: Path, image: np.ndarray, quality: int = 95) -> bool:
+    """Encode a BGR image to JPEG with libjpeg-turbo when available, else cv2."""
+    if _turbo_jpeg is not None:
+        data = _turbo_jpeg.encode(
+            np.ascontiguousarray(image), quality=quality, jpeg_subsample=TJSAMP_420
+        )
+        Path(path).write_bytes(data)
+        return True
     
-    return crops
+    return cv2.imwrite(str(path), image, [cv2.IMWRITE_JPEG_QUALITY, quality])
 
 
 def save_crops(
-    crops: List[Tuple[np.ndarray, Dict]],
+    crops: List[Tuple[np.ndarray, int]],
     output_dir: Path,
     image_name: str,
+    executor: Optional[ThreadPoolExecutor] = None,
+    pending: Optional[Deque[Future]] = None,
 ) -> List[str]:
-    """Save cropped regions to files."""
+    """
+    Save cropped regions to files.
+    
+    If an executor is given, the JPEG writes are submitted to it instead of
+    run inline and their futures are appended to `pending`.
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
     saved_paths = []
     
-    for i, (crop, det) in enumerate(crops):
+    for i, (crop, _) in enumerate(crops):
         crop_filename = f"{image_name}_crop_{i:03d}.jpg"
         crop_path = output_dir / crop_filename
-        cv2.imwrite(str(crop_path), crop)
+        if executor is not None:
+            pending.append(executor.submit(write_jpeg, crop_path, crop))
+        else:
+            write_jpeg(crop_path, crop)
         saved_paths.append(str(crop_path))
-        det['crop_path'] = str(crop_path)
     
     return saved_paths
 
 
+def recognize_crops(
+    ocr_engine,
+    crops: List[Tuple[np.ndarray, int]],
+    det_dicts: List[Dict],
+    batch_size: int = 8,
+):
+    """Run OCR directly on in-memory crops and store the text on each detection dict."""
+    ocr_results = ocr_engine.recognize_batch([crop for crop, _ in crops], batch_size)
+    
+    for (_, idx), (text, conf) in zip(crops, ocr_results):
+        det_dicts[idx]['ocr_text'] = text
+        det_dicts[idx]['ocr_confidence'] = round(conf, 4)
+
+
 def save_results_json(
     results: Dict,
     output_path: Path,
 ):
-    """Save detection results to JSON file."""
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    """Save detection results to JSON file (numpy values are serialized natively)."""
+    if ORJSON_AVAILABLE:
+        output_path.write_bytes(orjson.dumps(
+            results,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        ))
+    else:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False, default=_json_default)
+
+
+def dumps_line(obj: Dict) -> bytes:
+    """Serialize one ND-JSON record (compact, newline-terminated)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(
+            obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ) + b'\n'
+    
+    return (json.dumps(obj, ensure_ascii=False, default=_json_default) + '\n').encode('utf-8')
+
+
+def _json_default(obj):
+    """Convert numpy values for the stdlib json fallback."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 
 def draw_detections(
     image: np.ndarray,
-    detections: List[Dict],
+    detections: Detections,
     show_conf: bool = True,
     show_id: bool = True,
     color: Tuple[int, int, int] = (0, 255, 0),
@@ -160,31 +353,60 @@ def draw_detections(
     """Draw detection boxes on image."""
     img = image.copy()
     
-    for det in detections:
-        x1, y1, x2, y2 = det['box']
-        conf = det['confidence']
-        det_id = det['id']
-        
-        # Draw box
-        cv2.rectangle(img, (x1, y1), (x2, y2), color, thickness)
-        
-        # Draw label
+    if not len(detections):
+        return img
+    
+    # All box outlines in a single polylines call
+    x1, y1, x2, y2 = detections.boxes.T
+    corners = np.stack([
+        np.stack([x1, y1], axis=1),
+        np.stack([x2, y1], axis=1),
+        np.stack([x2, y2], axis=1),
+        np.stack([x1, y2], axis=1),
+    ], axis=1).astype(np.int32)
+    cv2.polylines(img, list(corners), True, color, thickness)
+    
+    if not (show_id or show_conf):
+        return img
+    
+    # Labels: filled backgrounds are drawn one by one because fillPoly uses
+    # even-odd filling and would punch holes where labels overlap
+    for det_id, (lx, ly) in enumerate(detections.boxes[:, :2].tolist()):
         label_parts = []
         if show_id:
             label_parts.append(f"#{det_id}")
         if show_conf:
-            label_parts.append(f"{conf:.2f}")
+            label_parts.append(f"{detections.conf[det_id]:.2f}")
         
-        if label_parts:
-            label = " ".join(label_parts)
-            (text_w, text_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-            cv2.rectangle(img, (x1, y1 - text_h - 4), (x1 + text_w + 4, y1), color, -1)
-            cv2.putText(img, label, (x1 + 2, y1 - 2), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        label = " ".join(label_parts)
+        (text_w, text_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        cv2.rectangle(img, (lx, ly - text_h - 4), (lx + text_w + 4, ly), color, -1)
+        cv2.putText(img, label, (lx + 2, ly - 2),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
     
     return img
 
 
+def sort_by_aspect_ratio(image_files: List[Path]) -> List[Path]:
+    """
+    Order images by aspect ratio (h / w) so each batch holds similarly shaped
+    images and letterboxing wastes less padding. Only the image headers are
+    read; files that cannot be opened are dropped here rather than mid-batch.
+    """
+    keyed = []
+    for f in image_files:
+        try:
+            with Image.open(f) as im:
+                w, h = im.size
+        except (OSError, SyntaxError) as e:
+            print(f"Skipping unreadable image {f}: {e}")
+            continue
+        keyed.append((h / w, f))
+    
+    keyed.sort(key=lambda item: item[0])
+    return [f for _, f in keyed]
+
+
 def process_directory(
     model: YOLO,
     source_dir: Path,
@@ -193,10 +415,22 @@ def process_directory(
     iou_threshold: float = 0.45,
     imgsz: int = 640,
     device: str = '0',
-    save_crops: bool = True,
+    save_crop_files: bool = True,
     save_visualizations: bool = True,
+    batch: int = 16,
+    ocr_engine=None,
+    ocr_batch_size: int = 8,
+    legacy_json: bool = False,
+    crop_nms_iou: Optional[float] = None,
 ) -> Dict:
-    """Process all images in a directory."""
+    """
+    Process all images in a directory, running the detector in batches.
+    
+    Results are streamed to all_detections.ndjson: a header line (model,
+    timestamp, config), one line per image, and a trailing summary line.
+    With legacy_json, per-image JSON files and a combined all_detections.json
+    are written instead (this keeps every result in memory).
+    """
     
     # Find images
     image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
@@ -211,6 +445,11 @@ def process_directory(
     
     print(f"Found {len(image_files)} images")
     
+    image_files = sort_by_aspect_ratio(image_files)
+    if not image_files:
+        print(f"No readable images in {source_dir}")
+        return {}
+    
     # Create output directories
     crops_dir = output_dir / 'crops'
     vis_dir = output_dir / 'visualizations'
@@ -218,7 +457,8 @@ def process_directory(
     
     crops_dir.mkdir(parents=True, exist_ok=True)
     vis_dir.mkdir(parents=True, exist_ok=True)
-    json_dir.mkdir(parents=True, exist_ok=True)
+    if legacy_json:
+        json_dir.mkdir(parents=True, exist_ok=True)
     
     all_results = {
         'model': str(model.model_name),
@@ -228,65 +468,152 @@ def process_directory(
             'iou_threshold': iou_threshold,
             'imgsz': imgsz,
         },
-        'images': [],
     }
     
-    total_detections = 0
-    
-    for img_path in tqdm(image_files, desc="Processing images"):
-        try:
-            # Run detection
-            detections, image = run_detection(
-                model, img_path, conf_threshold, iou_threshold, imgsz, device
-            )
-            
-            h, w = image.shape[:2]
-            
-            # Save crops
-            crop_paths = []
-            if save_crops and detections:
-                crops = crop_detections(image, detections)
-                crop_paths = save_crops(crops, crops_dir, img_path.stem)
-            
-            # Save visualization
-            vis_path = None
-            if save_visualizations and detections:
-                vis_image = draw_detections(image, detections)
-                vis_path = vis_dir / f"{img_path.stem}_detected.jpg"
-                cv2.imwrite(str(vis_path), vis_image)
+    # Everything opened below is released (file closed, pool drained, OpenCV
+    # thread count restored) even if processing raises
+    with ExitStack() as stack:
+        ndjson_file = None
+        if legacy_json:
+            all_results['images'] = []
+        else:
+            ndjson_path = output_dir / 'all_detections.ndjson'
+            ndjson_file = stack.enter_context(open(ndjson_path, 'wb'))
+            ndjson_file.write(dumps_line(all_results))
+        
+        total_detections = 0
+        processed_images = 0
+        
+        # Decode/encode on a thread pool so JPEG work overlaps GPU inference:
+        # reads for batch N+1 are in flight while batch N runs, and crop/vis
+        # writes complete in the background. Keep OpenCV's own pool out of it.
+        io_workers = os.cpu_count() or 1
+        io_pool = stack.enter_context(ThreadPoolExecutor(max_workers=io_workers))
+        stack.callback(cv2.setNumThreads, cv2.getNumThreads())
+        cv2.setNumThreads(1)
+        
+        # Queued writes hold crop views that pin their whole source image, so
+        # only a bounded number may be in flight
+        pending_writes: Deque[Future] = deque()
+        max_pending_writes = 4 * io_workers
+        
+        def wait_writes(limit: int):
+            while len(pending_writes) > limit:
+                try:
+                    pending_writes.popleft().result()
+                except Exception as e:
+                    print(f"Error writing image: {e}")
+        
+        def submit_reads(files: List[Path]) -> List[Future]:
+            return [io_pool.submit(cv2.imread, str(p)) for p in files]
+        
+        batches = [image_files[i:i + batch] for i in range(0, len(image_files), batch)]
+        pending_reads = submit_reads(batches[0])
+        
+        # Overlaps with the first reads
+        warmup_model(model, imgsz, device, min(batch, len(image_files)))
+        progress = tqdm(total=len(image_files), desc="Processing images")
+        
+        for batch_idx, batch_files in enumerate(batches):
+            batch_images = [f.result() for f in pending_reads]
+            if batch_idx + 1 < len(batches):
+                pending_reads = submit_reads(batches[batch_idx + 1])
             
-            # Create result entry
-            result = {
-                'image_path': str(img_path),
-                'image_size': {'width': w, 'height': h},
-                'num_detections': len(detections),
-                'detections': detections,
-            }
+            loaded = []
+            for img_path, image in zip(batch_files, batch_images):
+                if image is None:
+                    print(f"Error processing {img_path}: could not load image")
+                else:
+                    loaded.append((img_path, image))
             
-            if vis_path:
-                result['visualization_path'] = str(vis_path)
+            if not loaded:
+                progress.update(len(batch_files))
+                continue
             
-            all_results['images'].append(result)
-            total_detections += len(detections)
+            try:
+                batch_detections = run_detection_batch(
+                    model, [image for _, image in loaded],
+                    conf_threshold, iou_threshold, imgsz, device,
+                )
+            except Exception as e:
+                print(f"Error processing batch starting at {batch_files[0]}: {e}")
+                progress.update(len(batch_files))
+                continue
             
-            # Save individual JSON
-            json_path = json_dir / f"{img_path.stem}.json"
-            save_results_json(result, json_path)
+            for (img_path, image), detections in zip(loaded, batch_detections):
+                try:
+                    h, w = image.shape[:2]
+                    det_dicts = detections.to_dicts(model.names)
+                    
+                    # Save crops
+                    crop_paths = []
+                    if (save_crop_files or ocr_engine is not None) and detections:
+                        crops = crop_detections(image, detections, nms_iou=crop_nms_iou)
+                        
+                        # OCR straight from memory, no JPEG round-trip
+                        if ocr_engine is not None:
+                            recognize_crops(ocr_engine, crops, det_dicts, ocr_batch_size)
+                        
+                        if save_crop_files:
+                            crop_paths = save_crops(
+                                crops, crops_dir, img_path.stem, io_pool, pending_writes
+                            )
+                            for (_, idx), crop_path in zip(crops, crop_paths):
+                                det_dicts[idx]['crop_path'] = crop_path
+                    
+                    # Save visualization
+                    vis_path = None
+                    if save_visualizations and detections:
+                        vis_image = draw_detections(image, detections)
+                        vis_path = vis_dir / f"{img_path.stem}_detected.jpg"
+                        pending_writes.append(io_pool.submit(write_jpeg, vis_path, vis_image))
+                    
+                    # Create result entry
+                    result = {
+                        'image_path': str(img_path),
+                        'image_size': {'width': w, 'height': h},
+                        'num_detections': len(detections),
+                        'detections': det_dicts,
+                    }
+                    
+                    if vis_path:
+                        result['visualization_path'] = str(vis_path)
+                    
+                    total_detections += len(detections)
+                    processed_images += 1
+                    
+                    if legacy_json:
+                        all_results['images'].append(result)
+                        json_path = json_dir / f"{img_path.stem}.json"
+                        save_results_json(result, json_path)
+                    else:
+                        ndjson_file.write(dumps_line(result))
+                
+                except Exception as e:
+                    print(f"Error processing {img_path}: {e}")
+                
+                wait_writes(max_pending_writes)
             
-        except Exception as e:
-            print(f"Error processing {img_path}: {e}")
-            continue
-    
-    # Save combined results
-    all_results['summary'] = {
-        'total_images': len(image_files),
-        'processed_images': len(all_results['images']),
-        'total_detections': total_detections,
-        'avg_detections_per_image': total_detections / len(all_results['images']) if all_results['images'] else 0,
-    }
-    
-    combined_json_path = output_dir / 'all_detections.json'
-    save_results_json(all_results, combined_json_path)
+            progress.update(len(batch_files))
+        
+        progress.close()
+        
+        # Wait for outstanding image writes
+        wait_writes(0)
+        
+        # Save combined results
+        all_results['summary'] = {
+            'total_images': len(image_files),
+            'processed_images': processed_images,
+            'total_detections': total_detections,
+            'avg_detections_per_image': total_detections / processed_images if processed_images else 0,
+        }
+        
+        if legacy_json:
+            combined_json_path = output_dir / 'all_detections.json'
+            save_results_json(all_results, combined_json_path)
+        else:
+            ndjson_file.write(dumps_line({'summary': all_results['summary']}))
     
     print(f"\n✅ Processing complete!")
     print(f"   Total images: {len(image_files)}")
@@ -317,12 +644,16 @@ def main():
                        help='Image size')
     parser.add_argument('--device', type=str, default='0',
                        help='Device (0 for GPU, cpu for CPU)')
+    parser.add_argument('--batch', type=int, default=16,
+                       help='Batch size for directory inference (and TensorRT engine export)')
+    parser.add_argument('--no-engine', action='store_true',
+                       help='Do not export/use a TensorRT engine, run the .pt weights')
     
     # Output options
     parser.add_argument('--output', '-o', type=str, default='./outputs',
                        help='Output directory')
-    parser.add_argument('--save-crops', action='store_true', default=True,
-                       help='Save cropped detection regions')
+    parser.add_argument('--save-crops', action='store_true', default=None,
+                       help='Save cropped detection regions (default: on, off with --ocr)')
     parser.add_argument('--no-crops', action='store_true',
                        help='Do not save crops')
     parser.add_argument('--save-vis', action='store_true', default=True,
@@ -330,6 +661,20 @@ def main():
     parser.add_argument('--no-vis', action='store_true',
                        help='Do not save visualizations')
     
+    parser.add_argument('--crop-nms', type=float, default=None,
+                       help='Class-agnostic IoU threshold to dedupe overlapping boxes before cropping')
+    parser.add_argument('--legacy-json', action='store_true',
+                       help='Directory mode: write per-image JSON + all_detections.json instead of all_detections.ndjson')
+    
+    # OCR options
+    parser.add_argument('--ocr', action='store_true',
+                       help='Run TrOCR on the detected crops in the same pass')
+    parser.add_argument('--ocr-model', type=str,
+                       default='microsoft/trocr-base-handwritten',
+                       help='TrOCR model name (with --ocr)')
+    parser.add_argument('--ocr-batch-size', type=int, default=8,
+                       help='Batch size for OCR (with --ocr)')
+    
     args = parser.parse_args()
     
     # Check model exists
@@ -345,10 +690,23 @@ def main():
         sys.exit(1)
     
     # Load model
-    model = load_model(str(model_path), args.device)
+    model = load_model(
+        str(model_path), args.device, args.imgsz, args.batch, use_engine=not args.no_engine
+    )
+    
+    # Load OCR engine once for the combined detect + OCR path
+    ocr_engine = None
+    if args.ocr:
+        sys.path.insert(0, str(Path(__file__).parent.parent))
+        from scripts.run_ocr import TrOCREngine
+        
+        ocr_device = 'cpu' if args.device == 'cpu' else f"cuda:{args.device.split(',')[0]}"
+        ocr_engine = TrOCREngine(model_name=args.ocr_model, device=ocr_device)
     
     output_dir = Path(args.output)
-    save_crops_flag = args.save_crops and not args.no_crops
+    # With --ocr, crops go straight to the OCR engine and are only written on request
+    save_crops_flag = (args.save_crops if args.save_crops is not None else not args.ocr)
+    save_crops_flag = save_crops_flag and not args.no_crops
     save_vis_flag = args.save_vis and not args.no_vis
     
     if source_path.is_file():
@@ -360,12 +718,19 @@ def main():
         )
         
         print(f"Found {len(detections)} detections")
+        det_dicts = detections.to_dicts(model.names)
         
         # Save crops
-        if save_crops_flag and detections:
-            crops_dir = output_dir / 'crops'
-            crops = crop_detections(image, detections)
-            save_crops(crops, crops_dir, source_path.stem)
+        if (save_crops_flag or ocr_engine is not None) and detections:
+            crops = crop_detections(image, detections, nms_iou=args.crop_nms)
+            
+            if ocr_engine is not None:
+                recognize_crops(ocr_engine, crops, det_dicts, args.ocr_batch_size)
+            
+            if save_crops_flag:
+                crop_paths = save_crops(crops, output_dir / 'crops', source_path.stem)
+                for (_, idx), crop_path in zip(crops, crop_paths):
+                    det_dicts[idx]['crop_path'] = crop_path
         
         # Save visualization
         if save_vis_flag:
@@ -373,7 +738,7 @@ def main():
             vis_dir = output_dir / 'visualizations'
             vis_dir.mkdir(parents=True, exist_ok=True)
             vis_path = vis_dir / f"{source_path.stem}_detected.jpg"
-            cv2.imwrite(str(vis_path), vis_image)
+            write_jpeg(vis_path, vis_image)
             print(f"Visualization saved to: {vis_path}")
         
         # Save JSON
@@ -381,7 +746,7 @@ def main():
             'image_path': str(source_path),
             'image_size': {'width': image.shape[1], 'height': image.shape[0]},
             'num_detections': len(detections),
-            'detections': detections,
+            'detections': det_dicts,
         }
         
         json_dir = output_dir / 'detections'
@@ -391,9 +756,12 @@ def main():
         print(f"Results saved to: {json_path}")
         
         # Print detections
-        for det in detections:
-            print(f"  #{det['id']}: box={det['box']}, conf={det['confidence']:.3f}")
-        
+        for det in det_dicts:
+            line = f"  #{det['id']}: box={det['box']}, conf={det['confidence']:.3f}"
+            if 'ocr_text' in det:
+                line += f", text='{det['ocr_text']}'"
+            print(line)
+    
     else:
         # Directory
         process_directory(
@@ -404,8 +772,13 @@ def main():
             iou_threshold=args.iou,
             imgsz=args.imgsz,
             device=args.device,
-            save_crops=save_crops_flag,
+            save_crop_files=save_crops_flag,
             save_visualizations=save_vis_flag,
+            batch=args.batch,
+            ocr_engine=ocr_engine,
+            ocr_batch_size=args.ocr_batch_size,
+            legacy_json=args.legacy_json,
+            crop_nms_iou=args.crop_nms,
         )
 
 
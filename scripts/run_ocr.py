@@ -6,7 +6,11 @@ Runs TrOCR or EasyOCR on cropped detection regions
 import os
 import sys
 import json
+import shutil
 import argparse
+import importlib.util
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 import warnings
@@ -18,6 +22,15 @@ import torch
 from PIL import Image
 from tqdm import tqdm
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Inference-only script: no autograd bookkeeping anywhere
+torch.set_grad_enabled(False)
+
 
 def check_gpu():
     """Check GPU availability."""
@@ -38,34 +51,151 @@ class TrOCREngine:
         model_name: str = "microsoft/trocr-large-handwritten",  # Using LARGE model for better accuracy
         device: str = None,
         use_fp16: bool = True,
+        num_beams: int = 1,
+        max_new_tokens: int = 32,
+        compile: bool = False,
     ):
-        from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+        from transformers import TrOCRProcessor
         
         self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
-        self.use_fp16 = use_fp16 and self.device == 'cuda'
+        self.use_fp16 = use_fp16 and self.device.startswith('cuda')
+        # Greedy decoding by default (handwriting crops are short text);
+        # num_beams=4 is ~4x the decoder cost and KV-cache memory
+        self.num_beams = num_beams
+        self.max_new_tokens = max_new_tokens
         
         print(f"Loading TrOCR model: {model_name}")
         print(f"Device: {self.device}, FP16: {self.use_fp16}")
         
         self.processor = TrOCRProcessor.from_pretrained(model_name)
-        self.model = VisionEncoderDecoderModel.from_pretrained(model_name)
+        self.model = self._load_model(model_name)
+        self.model.config.use_cache = True
         
-        self.model.to(self.device)
-        if self.use_fp16:
-            self.model = self.model.half()
+        # Pixel preprocessing is done by _prep_np/_to_pixel_values; the HF
+        # processor only supplies its config (and the tokenizer for decoding)
+        image_processor = self.processor.image_processor
+        size = image_processor.size
+        if isinstance(size, dict):
+            self.input_size = (size['height'], size['width'])
+        else:
+            self.input_size = (size, size)
+        self.rescale_factor = image_processor.rescale_factor
+        self.do_normalize = image_processor.do_normalize
+        self.image_mean = torch.tensor(image_processor.image_mean, device=self.device).view(1, 3, 1, 1)
+        self.image_std = torch.tensor(image_processor.image_std, device=self.device).view(1, 3, 1, 1)
+        
+        # Reusable pinned host buffer so batch uploads can be truly async
+        self._pinned = None
+        self._copy_done = None
         
-        self.model.eval()
+        if compile:
+            self._compile()
+        
+        self.warmup()
         print("✅ TrOCR model loaded")
     
-    def preprocess(self, image: np.ndarray) -> Image.Image:
-        """Preprocess image for TrOCR."""
-        # Convert BGR to RGB if needed
-        if len(image.shape) == 3 and image.shape[2] == 3:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        elif len(image.shape) == 2:
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    def _load_model(self, model_name: str):
+        """Load the PyTorch encoder-decoder onto the device."""
+        from transformers import VisionEncoderDecoderModel
+        
+        model = VisionEncoderDecoderModel.from_pretrained(model_name)
+        model.to(self.device)
+        if self.use_fp16:
+            model = model.half()
+        
+        model.eval()
+        return model
+    
+    def warmup(self):
+        """Run one tiny generate so CUDA kernels and decoder caches are primed."""
+        h, w = self.input_size
+        dtype = torch.float16 if self.use_fp16 else torch.float32
+        dummy = torch.zeros((1, 3, h, w), dtype=dtype, device=self.device)
+        
+        with torch.inference_mode():
+            self.model.generate(dummy, max_new_tokens=4)
+        
+        if self.device.startswith('cuda'):
+            torch.cuda.synchronize()
+    
+    def _compile(self):
+        """Swap in fused SDPA attention (BetterTransformer) and compile the encoder."""
+        try:
+            from optimum.bettertransformer import BetterTransformer
+            self.model = BetterTransformer.transform(self.model, keep_original_model=False)
+            print("✅ BetterTransformer enabled")
+        except (ImportError, NotImplementedError, ValueError) as e:
+            print(f"⚠️  BetterTransformer unavailable ({e}), using torch.compile only")
+        
+        # Encoder input shape is fixed, so autotuning and CUDA graphs pay off
+        self.model.encoder = torch.compile(self.model.encoder, mode="max-autotune")
+    
+    def _generate(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Run generate under inference mode, autocast to FP16 when enabled."""
+        device_type = torch.device(self.device).type
+        
+        with torch.inference_mode(), torch.autocast(
+            device_type, dtype=torch.float16, enabled=self.use_fp16
+        ):
+            return self.model.generate(
+                pixel_values,
+                max_new_tokens=self.max_new_tokens,
+                num_beams=self.num_beams,
+                early_stopping=self.num_beams > 1,
+            )
+    
+    def _host_buffer(self, n: int) -> np.ndarray:
+        """
+        Return an (n, H, W, 3) uint8 array to fill with preprocessed crops.
+        
+        On CUDA this is a view of a persistent page-locked buffer (grown on
+        demand), so the following .to(device, non_blocking=True) is a real
+        async DMA instead of a staged synchronous copy.
+        """
+        h, w = self.input_size
+        
+        if not self.device.startswith('cuda'):
+            return np.empty((n, h, w, 3), dtype=np.uint8)
+        
+        if self._pinned is None or self._pinned.shape[0] < n:
+            self._pinned = torch.empty((n, h, w, 3), dtype=torch.uint8, pin_memory=True)
+        elif self._copy_done is not None:
+            # Previous upload must finish before the buffer is overwritten
+            self._copy_done.synchronize()
+        
+        return self._pinned[:n].numpy()
+    
+    def _prep_np(self, images: List[np.ndarray]) -> np.ndarray:
+        """Convert crops to RGB and resize to the model input size, stacked as (N, H, W, 3) uint8."""
+        h, w = self.input_size
+        batch = self._host_buffer(len(images))
+        
+        for i, image in enumerate(images):
+            if image.ndim == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+            elif image.shape[2] == 4:
+                image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+            else:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            batch[i] = cv2.resize(image, (w, h), interpolation=cv2.INTER_LINEAR)
         
-        return Image.fromarray(image)
+        return batch
+    
+    def _to_pixel_values(self, batch: np.ndarray) -> torch.Tensor:
+        """Upload a uint8 (N, H, W, 3) batch and rescale/normalize it on the device."""
+        pixel_values = torch.from_numpy(batch).to(self.device, non_blocking=True)
+        if self._pinned is not None:
+            self._copy_done = torch.cuda.Event()
+            self._copy_done.record()
+        
+        pixel_values = pixel_values.permute(0, 3, 1, 2).float().mul_(self.rescale_factor)
+        if self.do_normalize:
+            pixel_values.sub_(self.image_mean).div_(self.image_std)
+        
+        if self.use_fp16:
+            pixel_values = pixel_values.half()
+        
+        return pixel_values
     
     def recognize(self, image: np.ndarray) -> Tuple[str, float]:
         """
@@ -73,27 +203,14 @@ class TrOCREngine:
         
         Args:
             image: Input image (numpy array)
-            
+        
         Returns:
             text: Recognized text
             confidence: Recognition confidence (placeholder, TrOCR doesn't provide this directly)
         """
-        pil_image = self.preprocess(image)
-        
-        pixel_values = self.processor(
-            pil_image, return_tensors="pt"
-        ).pixel_values.to(self.device)
+        pixel_values = self._to_pixel_values(self._prep_np([image]))
         
-        if self.use_fp16:
-            pixel_values = pixel_values.half()
-        
-        with torch.no_grad():
-            generated_ids = self.model.generate(
-                pixel_values,
-                max_length=128,
-                num_beams=4,
-                early_stopping=True,
-            )
+        generated_ids = self._generate(pixel_values)
         
         text = self.processor.batch_decode(
             generated_ids, skip_special_tokens=True
@@ -115,22 +232,9 @@ class TrOCREngine:
         
         for i in range(0, len(images), batch_size):
             batch = images[i:i + batch_size]
-            pil_images = [self.preprocess(img) for img in batch]
-            
-            pixel_values = self.processor(
-                pil_images, return_tensors="pt", padding=True
-            ).pixel_values.to(self.device)
+            pixel_values = self._to_pixel_values(self._prep_np(batch))
             
-            if self.use_fp16:
-                pixel_values = pixel_values.half()
-            
-            with torch.no_grad():
-                generated_ids = self.model.generate(
-                    pixel_values,
-                    max_length=128,
-                    num_beams=4,
-                    early_stopping=True,
-                )
+            generated_ids = self._generate(pixel_values)
             
             texts = self.processor.batch_decode(
                 generated_ids, skip_special_tokens=True
@@ -142,69 +246,293 @@ class TrOCREngine:
         return results
 
 
+def onnx_model_dir(model_name: str) -> Path:
+    """Directory holding the ONNX export of a TrOCR checkpoint (int8 files in 'int8/')."""
+    return Path('models/ocr') / f"{model_name.replace('/', '--')}-onnx"
+
+
+def onnx_available() -> bool:
+    """Check whether optimum[onnxruntime] is installed."""
+    return (importlib.util.find_spec('optimum') is not None
+            and importlib.util.find_spec('onnxruntime') is not None)
+
+
+class TrOCROnnxEngine(TrOCREngine):
+    """
+    TrOCR served through ONNX Runtime with a dynamically quantized int8
+    encoder/decoder. Preprocessing and decoding are shared with TrOCREngine.
+    
+    On first use the checkpoint is exported with optimum and every ONNX
+    graph is quantized (int8 weights, dynamic activations) into
+    <onnx_dir>/int8. Dynamic int8 matmuls run best on the CPU provider; on
+    CUDA, ORT falls back to CPU for the quantized ops it cannot place.
+    """
+    
+    QUANTIZED_STEMS = {
+        'encoder_file_name': 'encoder_model',
+        'decoder_file_name': 'decoder_model',
+        'decoder_with_past_file_name': 'decoder_with_past_model',
+    }
+    
+    def __init__(
+        self,
+        model_name: str = "microsoft/trocr-large-handwritten",
+        device: str = None,
+        num_beams: int = 1,
+        max_new_tokens: int = 32,
+        onnx_dir: Optional[Path] = None,
+        **kwargs,
+    ):
+        self.onnx_dir = Path(onnx_dir) if onnx_dir else onnx_model_dir(model_name)
+        # int8 graphs: no FP16 cast, no torch.compile
+        super().__init__(
+            model_name=model_name,
+            device=device,
+            use_fp16=False,
+            num_beams=num_beams,
+            max_new_tokens=max_new_tokens,
+            compile=False,
+        )
+    
+    def _load_model(self, model_name: str):
+        """Export/quantize on first use, then load the int8 graphs with ONNX Runtime."""
+        from optimum.onnxruntime import ORTModelForVision2Seq
+        
+        int8_dir = self.onnx_dir / 'int8'
+        if not int8_dir.exists():
+            self.export(model_name)
+        
+        file_names = {
+            key: f"{stem}_quantized.onnx"
+            for key, stem in self.QUANTIZED_STEMS.items()
+            if (int8_dir / f"{stem}_quantized.onnx").exists()
+        }
+        provider = 'CUDAExecutionProvider' if self.device.startswith('cuda') else 'CPUExecutionProvider'
+        
+        print(f"Loading ONNX int8 TrOCR from {int8_dir} ({provider})")
+        return ORTModelForVision2Seq.from_pretrained(
+            int8_dir, provider=provider, use_cache=True, **file_names
+        )
+    
+    def export(self, model_name: str):
+        """Export model_name to ONNX and write int8-quantized copies of each graph."""
+        from optimum.onnxruntime import ORTModelForVision2Seq, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        
+        int8_dir = self.onnx_dir / 'int8'
+        print(f"Exporting {model_name} to ONNX: {self.onnx_dir}")
+        
+        model = ORTModelForVision2Seq.from_pretrained(model_name, export=True, use_cache=True)
+        model.save_pretrained(self.onnx_dir)
+        
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        for onnx_file in sorted(self.onnx_dir.glob('*.onnx')):
+            print(f"Quantizing {onnx_file.name} -> int8")
+            quantizer = ORTQuantizer.from_pretrained(self.onnx_dir, file_name=onnx_file.name)
+            quantizer.quantize(save_dir=int8_dir, quantization_config=qconfig)
+        
+        # Model/generation configs are needed next to the quantized graphs
+        for config_file in self.onnx_dir.glob('*.json'):
+            if not (int8_dir / config_file.name).exists():
+                shutil.copy(config_file, int8_dir / config_file.name)
+
+
+def _combine_easyocr_results(results) -> Tuple[str, float]:
+    """Join EasyOCR readtext output into one (text, mean confidence) pair."""
+    if not results:
+        return "", 0.0
+    
+    # Combine all detected text
+    texts = []
+    confidences = []
+    
+    for (bbox, text, conf) in results:
+        texts.append(text)
+        confidences.append(conf)
+    
+    combined_text = " ".join(texts)
+    avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    
+    return combined_text, avg_confidence
+
+
+# Per-process reader for the CPU worker pool
+_worker_reader = None
+
+
+def _init_easyocr_worker(languages: List[str], num_threads: int):
+    """Pool initializer: build one CPU EasyOCR reader per worker process."""
+    global _worker_reader
+    import easyocr
+    
+    torch.set_num_threads(num_threads)
+    _worker_reader = easyocr.Reader(languages, gpu=False, verbose=False)
+
+
+def _easyocr_worker_recognize(image: np.ndarray) -> Tuple[str, float]:
+    return _combine_easyocr_results(_worker_reader.readtext(image))
+
+
 class EasyOCREngine:
-    """EasyOCR-based text recognition (lighter weight alternative)."""
+    """
+    EasyOCR-based text recognition (lighter weight alternative).
+    
+    EasyOCR has no batch API, so recognize_batch runs images concurrently:
+    on CPU across a process pool (one reader per process), on GPU across
+    two threads, each with its own reader and CUDA stream.
+    """
     
     def __init__(
         self,
         languages: List[str] = ['en'],
         use_gpu: bool = True,
+        num_workers: Optional[int] = None,
     ):
         import easyocr
         
         print(f"Loading EasyOCR (languages: {languages})")
         self.reader = easyocr.Reader(languages, gpu=use_gpu)
-        print("✅ EasyOCR loaded")
-    
-    def recognize(self, image: np.ndarray) -> Tuple[str, float]:
-        """Recognize text in image."""
-        results = self.reader.readtext(image)
-        
-        if not results:
-            return "", 0.0
-        
-        # Combine all detected text
-        texts = []
-        confidences = []
+        self.use_gpu = use_gpu and torch.cuda.is_available()
         
-        for (bbox, text, conf) in results:
-            texts.append(text)
-            confidences.append(conf)
+        self.pool = None
+        self.executor = None
         
-        combined_text = " ".join(texts)
-        avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        if self.use_gpu:
+            num_workers = num_workers or 2
+            self.readers = [self.reader] + [
+                easyocr.Reader(languages, gpu=True, verbose=False)
+                for _ in range(num_workers - 1)
+            ]
+            self.streams = [torch.cuda.Stream() for _ in self.readers]
+            self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        else:
+            num_workers = num_workers or min(4, os.cpu_count() or 1)
+            if num_workers > 1:
+                threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+                ctx = multiprocessing.get_context('spawn')
+                self.pool = ctx.Pool(
+                    num_workers,
+                    initializer=_init_easyocr_worker,
+                    initargs=(languages, threads_per_worker),
+                )
         
-        return combined_text, avg_confidence
+        print(f"✅ EasyOCR loaded ({num_workers} workers)")
+    
+    def recognize(self, image: np.ndarray) -> Tuple[str, float]:
+        """Recognize text in image."""
+        return _combine_easyocr_results(self.reader.readtext(image))
+    
+    def _recognize_on_stream(self, worker: int, images: List[np.ndarray]) -> List[Tuple[str, float]]:
+        """Run one GPU worker's share of a batch on its own reader and stream."""
+        with torch.cuda.stream(self.streams[worker]):
+            return [
+                _combine_easyocr_results(self.readers[worker].readtext(img))
+                for img in images
+            ]
     
     def recognize_batch(
         self, 
         images: List[np.ndarray], 
         batch_size: int = 8
     ) -> List[Tuple[str, float]]:
-        """Recognize text in batch of images."""
-        # EasyOCR doesn't have native batch support, process one by one
-        results = []
-        for img in images:
-            text, conf = self.recognize(img)
-            results.append((text, conf))
-        return results
+        """Recognize text in batch of images (concurrently, order preserved)."""
+        if self.pool is not None:
+            return self.pool.map(_easyocr_worker_recognize, images, chunksize=batch_size)
+        
+        if self.executor is not None:
+            # Interleave images across workers, then restore the input order
+            n = len(self.readers)
+            futures = [
+                self.executor.submit(self._recognize_on_stream, k, images[k::n])
+                for k in range(n)
+            ]
+            results = [None] * len(images)
+            for k, future in enumerate(futures):
+                results[k::n] = future.result()
+            return results
+        
+        return [self.recognize(img) for img in images]
+    
+    def close(self, terminate: bool = False):
+        """Shut down worker processes/threads (terminate: drop queued work instead of finishing it)."""
+        if self.pool is not None:
+            if terminate:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=terminate)
+            self.executor = None
+
+
+def save_json(data: Dict, output_path: Path):
+    """Write results as indented UTF-8 JSON, using orjson when available."""
+    if ORJSON_AVAILABLE:
+        output_path.write_bytes(orjson.dumps(
+            data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+        ))
+    else:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
 
 
 def load_ocr_engine(engine_type: str = 'trocr', **kwargs):
     """Load OCR engine."""
     if engine_type == 'trocr':
         return TrOCREngine(**kwargs)
+    elif engine_type == 'trocr-onnx':
+        return TrOCROnnxEngine(**kwargs)
     elif engine_type == 'easyocr':
         return EasyOCREngine(**kwargs)
     else:
         raise ValueError(f"Unknown OCR engine: {engine_type}")
 
 
+REDUCED_COLOR_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def load_crop(
+    crop_path: Path,
+    downscale: int = 1,
+    target_size: Optional[Tuple[int, int]] = None,
+) -> Optional[np.ndarray]:
+    """
+    Load a crop image, optionally decoding at up to 1/downscale resolution.
+    
+    Reduced decoding lets libjpeg skip most of the IDCT work for crops that
+    the OCR model will shrink anyway. With a target_size (h, w), the crop's
+    native size is read from its header first and the largest factor whose
+    reduced image still covers the target on both sides is used (often 1 for
+    short line crops), so every crop is decoded exactly once.
+    """
+    factor = downscale if downscale in REDUCED_COLOR_FLAGS else 1
+    
+    if factor > 1 and target_size is not None:
+        try:
+            with Image.open(crop_path) as header:  # parses the header only
+                w, h = header.size
+        except (OSError, ValueError):
+            w = h = 0
+        while factor > 1 and (h // factor < target_size[0] or w // factor < target_size[1]):
+            factor //= 2
+    
+    if factor > 1:
+        return cv2.imread(str(crop_path), REDUCED_COLOR_FLAGS[factor])
+    return cv2.imread(str(crop_path))
+
+
 def process_crops(
     ocr_engine,
     crops_dir: Path,
     output_dir: Path,
     batch_size: int = 8,
+    downscale: int = 1,
 ) -> Dict:
     """Process all crop images in directory."""
     
@@ -225,8 +553,10 @@ def process_crops(
     images = []
     valid_files = []
     
+    target_size = getattr(ocr_engine, 'input_size', None)
+    
     for crop_path in crop_files:
-        img = cv2.imread(str(crop_path))
+        img = load_crop(crop_path, downscale, target_size)
         if img is not None:
             images.append(img)
             valid_files.append(crop_path)
@@ -258,24 +588,47 @@ def process_crops(
     output_dir.mkdir(parents=True, exist_ok=True)
     json_path = output_dir / 'ocr_results.json'
     
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    save_json(results, json_path)
     
     print(f"\n✅ OCR complete! Results saved to: {json_path}")
     
     return results
 
 
+def load_detection_ndjson(path: Path) -> Dict:
+    """
+    Load run_inference's all_detections.ndjson into the combined JSON layout
+    (header fields, 'images' list, 'summary').
+    """
+    detection_data = {'images': []}
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'detections' in record:
+                detection_data['images'].append(record)
+            else:
+                detection_data.update(record)
+    
+    return detection_data
+
+
 def process_detection_json(
     ocr_engine,
     detection_json: Path,
     output_dir: Path,
     batch_size: int = 8,
+    downscale: int = 1,
 ) -> Dict:
     """Process crops referenced in detection JSON file."""
     
-    with open(detection_json, 'r') as f:
-        detection_data = json.load(f)
+    if detection_json.suffix == '.ndjson':
+        detection_data = load_detection_ndjson(detection_json)
+    else:
+        with open(detection_json, 'r') as f:
+            detection_data = json.load(f)
     
     # Collect all crops
     crops_to_process = []
@@ -302,9 +655,11 @@ def process_detection_json(
     images = []
     valid_crops = []
     
+    target_size = getattr(ocr_engine, 'input_size', None)
+    
     for det, crop_path in crops_to_process:
         if crop_path.exists():
-            img = cv2.imread(str(crop_path))
+            img = load_crop(crop_path, downscale, target_size)
             if img is not None:
                 images.append(img)
                 valid_crops.append((det, crop_path))
@@ -323,8 +678,7 @@ def process_detection_json(
     output_dir.mkdir(parents=True, exist_ok=True)
     output_json = output_dir / 'detections_with_ocr.json'
     
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(detection_data, f, indent=2, ensure_ascii=False)
+    save_json(detection_data, output_json)
     
     print(f"\n✅ OCR complete! Updated JSON saved to: {output_json}")
     
@@ -341,12 +695,12 @@ def main():
     parser.add_argument('--crops', '-c', type=str,
                        help='Path to crops directory')
     parser.add_argument('--detection-json', '-d', type=str,
-                       help='Path to detection JSON file (alternative to --crops)')
+                       help='Path to detection JSON/NDJSON file (alternative to --crops)')
     
     # OCR engine options
     parser.add_argument('--engine', '-e', type=str, default='trocr',
-                       choices=['trocr', 'easyocr'],
-                       help='OCR engine to use')
+                       choices=['trocr', 'trocr-onnx', 'easyocr'],
+                       help='OCR engine to use (trocr-onnx exports + quantizes to int8 on first use)')
     parser.add_argument('--model', '-m', type=str, 
                        default='microsoft/trocr-base-handwritten',
                        help='TrOCR model name (for trocr engine)')
@@ -360,6 +714,16 @@ def main():
                        help='Device (cuda/cpu)')
     parser.add_argument('--no-fp16', action='store_true',
                        help='Disable FP16 inference')
+    parser.add_argument('--ocr-downscale', type=int, default=1, choices=[1, 2, 4, 8],
+                       help='Decode crops at up to 1/N resolution, never below the OCR model input size')
+    parser.add_argument('--num-beams', type=int, default=1,
+                       help='Beam width for TrOCR decoding (1 = greedy)')
+    parser.add_argument('--max-new-tokens', type=int, default=32,
+                       help='Maximum tokens generated per crop (TrOCR)')
+    parser.add_argument('--accurate', action='store_true',
+                       help='Shortcut for --num-beams 4 (slower, slightly better CER)')
+    parser.add_argument('--compile', action='store_true',
+                       help='Use BetterTransformer + torch.compile for TrOCR (slow first batch)')
     
     # Output
     parser.add_argument('--output', '-o', type=str, default='./outputs/ocr',
@@ -375,14 +739,38 @@ def main():
     # Check GPU
     has_gpu = check_gpu()
     
+    num_beams = 4 if args.accurate else args.num_beams
+    
     # Load OCR engine
-    if args.engine == 'trocr':
+    engine_type = args.engine
+    print(f"OCR engine: {engine_type}")
+    
+    if engine_type == 'trocr-onnx':
+        if not onnx_available():
+            print("❌ trocr-onnx needs optimum[onnxruntime]: pip install optimum[onnxruntime] (or .[onnx])")
+            sys.exit(1)
+        device = args.device or ('cuda' if has_gpu else 'cpu')
+        if device.startswith('cuda'):
+            print("⚠️  int8 ONNX graphs mostly run on the CPU provider; --engine trocr is faster on GPU")
+        if args.compile or args.no_fp16:
+            print("⚠️  --compile/--no-fp16 do not apply to trocr-onnx (int8 graphs)")
+        ocr_engine = load_ocr_engine(
+            'trocr-onnx',
+            model_name=args.model,
+            device=device,
+            num_beams=num_beams,
+            max_new_tokens=args.max_new_tokens,
+        )
+    elif engine_type == 'trocr':
         device = args.device or ('cuda' if has_gpu else 'cpu')
         ocr_engine = load_ocr_engine(
             'trocr',
             model_name=args.model,
             device=device,
             use_fp16=not args.no_fp16 and device == 'cuda',
+            num_beams=num_beams,
+            max_new_tokens=args.max_new_tokens,
+            compile=args.compile,
         )
     else:
         ocr_engine = load_ocr_engine(
@@ -393,31 +781,38 @@ def main():
     
     output_dir = Path(args.output)
     
-    # Process based on input type
-    if args.detection_json:
-        detection_json = Path(args.detection_json)
-        if not detection_json.exists():
-            print(f"❌ Detection JSON not found: {detection_json}")
-            sys.exit(1)
-        
-        process_detection_json(
-            ocr_engine=ocr_engine,
-            detection_json=detection_json,
-            output_dir=output_dir,
-            batch_size=args.batch_size,
-        )
-    else:
-        crops_dir = Path(args.crops)
-        if not crops_dir.exists():
-            print(f"❌ Crops directory not found: {crops_dir}")
-            sys.exit(1)
-        
-        process_crops(
-            ocr_engine=ocr_engine,
-            crops_dir=crops_dir,
-            output_dir=output_dir,
-            batch_size=args.batch_size,
-        )
+    try:
+        # Process based on input type
+        if args.detection_json:
+            detection_json = Path(args.detection_json)
+            if not detection_json.exists():
+                print(f"❌ Detection JSON not found: {detection_json}")
+                sys.exit(1)
+            
+            process_detection_json(
+                ocr_engine=ocr_engine,
+                detection_json=detection_json,
+                output_dir=output_dir,
+                batch_size=args.batch_size,
+                downscale=args.ocr_downscale,
+            )
+        else:
+            crops_dir = Path(args.crops)
+            if not crops_dir.exists():
+                print(f"❌ Crops directory not found: {crops_dir}")
+                sys.exit(1)
+            
+            process_crops(
+                ocr_engine=ocr_engine,
+                crops_dir=crops_dir,
+                output_dir=output_dir,
+                batch_size=args.batch_size,
+                downscale=args.ocr_downscale,
+            )
+    finally:
+        # Always reap EasyOCR's worker processes; on errors don't wait for queued work
+        if isinstance(ocr_engine, EasyOCREngine):
+            ocr_engine.close(terminate=sys.exc_info()[0] is not None)
 
 
 if __name__ == "__main__":
@@ -4,14 +4,27 @@ Optimized for NVIDIA RTX 3050 (8GB VRAM)
 """
 
 import os
+import gc
 import sys
 import argparse
 from pathlib import Path
 from datetime import datetime
 import yaml
 
+# Must be set before torch initializes CUDA: expandable segments keep the caching
+# allocator from fragmenting into OOMs at marginal batch sizes on 8GB cards
+os.environ.setdefault('PYTORCH_CUDA_ALLOC_CONF', 'expandable_segments:True,max_split_size_mb:128')
+
 import torch
 from ultralytics import YOLO
+from ultralytics.utils import DEFAULT_CFG_KEYS
+
+
+# Every argument YOLO.train() understands (it only takes **kwargs, so use the config schema)
+TRAIN_KEYS = set(DEFAULT_CFG_KEYS) - {'data', 'model', 'verbose'}
+
+# Dataloader workers scale with the host; Ultralytics' loader keeps them alive across epochs
+DEFAULT_WORKERS = min(8, os.cpu_count() or 4)
 
 
 def check_gpu():
@@ -53,13 +66,14 @@ def get_rtx3050_defaults() -> dict:
     """Get default training parameters optimized for RTX 3050."""
     return {
         'epochs': 50,
-        'batch': 4,
+        'batch': -1,  # auto: largest batch fitting ~60% of VRAM
         'imgsz': 640,
         'device': 0,
         'amp': True,
-        'workers': 4,
-        'cache': False,
+        'workers': DEFAULT_WORKERS,
+        'cache': 'ram',  # decode once; Ultralytics falls back to no cache if RAM is short
         'patience': 10,
+        'save': True,
         'save_period': 5,
         'exist_ok': True,
         'pretrained': True,
@@ -88,6 +102,34 @@ def get_rtx3050_defaults() -> dict:
     }
 
 
+def release_gpu_memory():
+    """Collect dropped models and hand cached CUDA blocks back to the driver."""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+        torch.cuda.empty_cache()
+        torch.cuda.ipc_collect()
+
+
+def warmup_allocator(model: torch.nn.Module, batch: int, imgsz: int, device: str, amp: bool = True):
+    """
+    Run one dummy forward pass at the training shape so the CUDA caching
+    allocator already holds blocks of the sizes epoch 0 will ask for.
+    
+    The model is moved back to the CPU afterwards (its blocks stay cached):
+    the trainer builds its own CUDA copy, so this one must not stay resident.
+    """
+    model.to(device).eval()  # eval: don't let the zeros touch BatchNorm stats
+    try:
+        dummy = torch.zeros(batch, 3, imgsz, imgsz, device=device)
+        with torch.inference_mode(), torch.autocast('cuda', enabled=amp):
+            model(dummy)
+        del dummy
+        torch.cuda.synchronize()
+    finally:
+        model.to('cpu')
+
+
 def train(
     data: str,
     model: str = 'yolov8n.pt',
@@ -101,8 +143,10 @@ def train(
     resume: str = None,
     amp: bool = True,
     workers: int = None,
+    cache: str = None,
     patience: int = None,
     save_period: int = None,
+    compile: bool = False,
     verbose: bool = True,
 ):
     """
@@ -113,7 +157,7 @@ def train(
         model: Model to use (yolov8n.pt, yolov8s.pt, etc.)
         config: Path to config YAML file
         epochs: Number of training epochs
-        batch: Batch size
+        batch: Batch size (-1 to pick automatically from free VRAM)
         imgsz: Image size
         device: Device to use (0, cpu, etc.)
         project: Project directory
@@ -121,14 +165,24 @@ def train(
         resume: Path to checkpoint to resume from
         amp: Use automatic mixed precision
         workers: Number of dataloader workers
+        cache: Image cache for the dataloader ('ram', 'disk' or 'none')
         patience: Early stopping patience
         save_period: Save checkpoint every N epochs
+        compile: Compile the model with torch.compile(mode="reduce-overhead")
         verbose: Print verbose output
     """
     
     # Check GPU
     has_gpu = check_gpu()
     
+    # TF32 tensor cores for the FP32 matmuls/convs left outside autocast (Ampere+),
+    # and cudnn autotuning since training shapes are fixed at imgsz
+    if has_gpu:
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cudnn.benchmark = True
+        torch.set_float32_matmul_precision('high')
+    
     # Load defaults
     params = get_rtx3050_defaults()
     
@@ -153,12 +207,23 @@ def train(
         params['device'] = 'cpu'
     if workers is not None:
         params['workers'] = workers
+    if cache is not None:
+        params['cache'] = False if cache == 'none' else cache
     if patience is not None:
         params['patience'] = patience
     if save_period is not None:
         params['save_period'] = save_period
     params['amp'] = amp
     
+    # CUDA graphs cut per-step launch overhead at small batch sizes; shapes stay static since
+    # every batch is letterboxed to imgsz. Ultralytics must own the compile so EMA updates and
+    # checkpoints see the uncompiled module (compiled state_dict keys gain an _orig_mod. prefix)
+    if compile:
+        if 'compile' in TRAIN_KEYS:
+            params['compile'] = 'reduce-overhead'
+        else:
+            print("⚠️  Installed Ultralytics has no compile option; training uncompiled")
+    
     # Set project and name
     params['project'] = project
     if name:
@@ -175,6 +240,27 @@ def train(
         print(f"\n📦 Loading model: {model}")
         yolo_model = YOLO(model)
     
+    cuda_device = None
+    if has_gpu and str(params['device']) != 'cpu':
+        cuda_device = f"cuda:{str(params['device']).split(',')[0]}"
+    
+    # Auto batch size: profile memory use on a few batch sizes and fit the largest safe one
+    if params['batch'] is None or params['batch'] < 1:
+        if cuda_device:
+            from ultralytics.utils.autobatch import check_train_batch_size
+            
+            # AutoBatch refuses to profile with cudnn autotuning on
+            torch.backends.cudnn.benchmark = False
+            params['batch'] = check_train_batch_size(
+                yolo_model.model.to(cuda_device), imgsz=params['imgsz'], amp=params['amp']
+            )
+            torch.backends.cudnn.benchmark = True
+        else:
+            params['batch'] = 4
+    
+    if cuda_device:
+        warmup_allocator(yolo_model.model, params['batch'], params['imgsz'], cuda_device, params['amp'])
+    
     # Print configuration
     print("\n" + "="*60)
     print(" Training Configuration")
@@ -187,6 +273,8 @@ def train(
     print(f"Device: {params['device']}")
     print(f"AMP (Mixed Precision): {params['amp']}")
     print(f"Workers: {params['workers']}")
+    print(f"Cache: {params['cache']}")
+    print(f"Compile: {params.get('compile', False)}")
     print(f"Project: {params['project']}")
     print(f"Name: {params['name']}")
     
@@ -206,43 +294,8 @@ def train(
         # Train
         results = yolo_model.train(
             data=data,
-            epochs=params['epochs'],
-            batch=params['batch'],
-            imgsz=params['imgsz'],
-            device=params['device'],
-            amp=params['amp'],
-            workers=params['workers'],
-            patience=params['patience'],
-            save=True,
-            save_period=params['save_period'],
-            cache=params['cache'],
-            exist_ok=params['exist_ok'],
-            pretrained=params['pretrained'],
-            optimizer=params['optimizer'],
-            lr0=params['lr0'],
-            lrf=params['lrf'],
-            momentum=params['momentum'],
-            weight_decay=params['weight_decay'],
-            warmup_epochs=params['warmup_epochs'],
-            box=params['box'],
-            cls=params['cls'],
-            dfl=params['dfl'],
-            hsv_h=params['hsv_h'],
-            hsv_s=params['hsv_s'],
-            hsv_v=params['hsv_v'],
-            degrees=params['degrees'],
-            translate=params['translate'],
-            scale=params['scale'],
-            shear=params['shear'],
-            perspective=params['perspective'],
-            flipud=params['flipud'],
-            fliplr=params['fliplr'],
-            mosaic=params['mosaic'],
-            mixup=params['mixup'],
-            copy_paste=params['copy_paste'],
-            project=params['project'],
-            name=params['name'],
             verbose=verbose,
+            **{k: v for k, v in params.items() if k in TRAIN_KEYS},
         )
         
         print("\n" + "="*60)
@@ -273,8 +326,13 @@ def train(
             print("3. Reduce workers: --workers 2")
             print("4. Close other GPU applications")
             print("5. Check nvidia-smi for memory usage")
-            torch.cuda.empty_cache()
         raise
+    
+    finally:
+        # The trainer (model, EMA, optimizer state, dataloaders) hangs off yolo_model; drop it
+        # so a following validation run or caller doesn't OOM on the leftovers
+        del yolo_model
+        release_gpu_memory()
 
 
 def validate(
@@ -333,14 +391,16 @@ def main():
     # Training parameters (RTX 3050 optimized defaults)
     parser.add_argument('--epochs', '-e', type=int, default=50,
                        help='Number of epochs')
-    parser.add_argument('--batch', '-b', type=int, default=4,
-                       help='Batch size (reduce to 2 if OOM)')
+    parser.add_argument('--batch', '-b', type=int, default=-1,
+                       help='Batch size (-1 = auto-fit to VRAM; set 2 if OOM)')
     parser.add_argument('--imgsz', type=int, default=640,
                        help='Image size (reduce to 512 if OOM)')
     parser.add_argument('--device', type=str, default='0',
                        help='Device (0 for GPU, cpu for CPU)')
-    parser.add_argument('--workers', '-w', type=int, default=4,
+    parser.add_argument('--workers', '-w', type=int, default=DEFAULT_WORKERS,
                        help='Number of dataloader workers')
+    parser.add_argument('--cache', type=str, default='ram', choices=['ram', 'disk', 'none'],
+                       help='Cache decoded images (ram/disk) to skip per-epoch JPEG decode')
     
     # Memory optimization
     parser.add_argument('--no-amp', action='store_true',
@@ -358,6 +418,10 @@ def main():
     parser.add_argument('--save-period', type=int, default=5,
                        help='Save checkpoint every N epochs')
     
+    # Speed
+    parser.add_argument('--compile', action='store_true',
+                       help='torch.compile the model (reduce-overhead / CUDA graphs)')
+    
     # Validation mode
     parser.add_argument('--val', action='store_true',
                        help='Run validation only')
@@ -387,7 +451,7 @@ def main():
             model=args.resume,
             data=args.data,
             imgsz=args.imgsz,
-            batch=args.batch,
+            batch=args.batch if args.batch > 0 else 4,
             device=args.device,
             verbose=not args.quiet,
         )
@@ -406,8 +470,10 @@ def main():
             resume=args.resume,
             amp=not args.no_amp,
             workers=args.workers,
+            cache=args.cache,
             patience=args.patience,
             save_period=args.save_period,
+            compile=args.compile,
             verbose=not args.quiet,
         )
 
@@ -7,67 +7,113 @@ import os
 import sys
 import argparse
 import random
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Union
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 from tqdm import tqdm
-import yaml
 
 
-def load_yolo_labels(label_path: Path) -> List[Tuple[int, float, float, float, float]]:
-    """Load YOLO format labels from file."""
-    labels = []
-    if not label_path.exists():
-        return labels
-    
-    with open(label_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) == 5:
-                try:
-                    cls = int(parts[0])
-                    x_center, y_center, width, height = map(float, parts[1:])
-                    labels.append((cls, x_center, y_center, width, height))
-                except ValueError:
-                    continue
-    return labels
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
 
-def yolo_to_bbox(yolo_box: Tuple[int, float, float, float, float], 
-                  img_width: int, img_height: int) -> Tuple[int, int, int, int]:
-    """Convert YOLO format to pixel coordinates (x1, y1, x2, y2)."""
-    cls, x_center, y_center, w, h = yolo_box
-    
-    x1 = int((x_center - w/2) * img_width)
-    y1 = int((y_center - h/2) * img_height)
-    x2 = int((x_center + w/2) * img_width)
-    y2 = int((y_center + h/2) * img_height)
-    
-    return x1, y1, x2, y2
+def list_files(directory: Union[str, Path], extensions: Tuple[str, ...]) -> List[str]:
+    """
+    List file paths with one of the given extensions under a directory,
+    including sharded subdirectories (e.g. images/train/<form_id>/).
+    """
+    files = []
+    pending = [directory]
+    while pending:
+        with os.scandir(pending.pop()) as it:
+            for entry in it:
+                if entry.is_dir():
+                    pending.append(entry.path)
+                elif entry.name.lower().endswith(extensions) and entry.is_file():
+                    files.append(entry.path)
+    return files
+
+
+def file_key(path: str, root: Union[str, Path]) -> str:
+    """Path relative to root without extension (unique across shards, e.g. 'a01-000u/a01-000u-00')."""
+    return os.path.splitext(os.path.relpath(path, root))[0]
+
+
+def parse_yolo_labels(data: bytes) -> np.ndarray:
+    """Parse the contents of a YOLO label file into an (N, 5) float32 array."""
+    lines = data.splitlines()
+    
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)  # empty label files
+            labels = np.loadtxt(lines, ndmin=2, dtype=np.float32)
+        if labels.size == 0:
+            return np.empty((0, 5), dtype=np.float32)
+        if labels.shape[1] == 5:
+            return labels
+    except ValueError:
+        pass
+    
+    # Malformed file: fall back to per-line parsing, skipping bad lines
+    rows = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 5:
+            try:
+                rows.append([int(parts[0])] + [float(p) for p in parts[1:]])
+            except ValueError:
+                continue
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
+
+
+def load_yolo_labels(label_path: Union[str, Path]) -> np.ndarray:
+    """Load YOLO format labels from file as an (N, 5) float32 array."""
+    try:
+        with open(label_path, 'rb') as f:
+            return parse_yolo_labels(f.read())
+    except FileNotFoundError:
+        return np.empty((0, 5), dtype=np.float32)
+
 
+def yolo_to_bbox(labels: np.ndarray, img_width: int, img_height: int) -> np.ndarray:
+    """Convert (N, 5) YOLO labels to (N, 4) int32 pixel boxes (x1, y1, x2, y2)."""
+    x_center, y_center = labels[:, 1], labels[:, 2]
+    half_w, half_h = labels[:, 3] / 2, labels[:, 4] / 2
+    
+    return np.stack([
+        (x_center - half_w) * img_width,
+        (y_center - half_h) * img_height,
+        (x_center + half_w) * img_width,
+        (y_center + half_h) * img_height,
+    ], axis=1).astype(np.int32)
 
-def draw_boxes(image: np.ndarray, labels: List[Tuple], 
-               class_names: dict = None) -> np.ndarray:
-    """Draw bounding boxes on image."""
-    img = image.copy()
+
+def draw_boxes(image: np.ndarray, labels: np.ndarray, 
+               class_names: dict = None, inplace: bool = False) -> np.ndarray:
+    """Draw bounding boxes on image (on a copy unless inplace=True)."""
+    img = image if inplace else image.copy()
     h, w = img.shape[:2]
     
     colors = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (255, 255, 0)]
     
-    for label in labels:
-        cls, x_center, y_center, bw, bh = label
-        x1, y1, x2, y2 = yolo_to_bbox(label, w, h)
-        
-        color = colors[cls % len(colors)]
-        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
-        
+    boxes = yolo_to_bbox(labels, w, h)
+    classes = labels[:, 0].astype(int)
+    
+    # Label text, its size and the color only depend on the class, so resolve them once per class
+    styles = {}
+    for cls in np.unique(classes).tolist():
         class_name = class_names.get(cls, f"class_{cls}") if class_names else f"class_{cls}"
         label_text = f"{class_name}"
-        
         (text_w, text_h), _ = cv2.getTextSize(label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        styles[cls] = (label_text, text_w, text_h, colors[cls % len(colors)])
+    
+    for (x1, y1, x2, y2), cls in zip(boxes.tolist(), classes.tolist()):
+        label_text, text_w, text_h, color = styles[cls]
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
         cv2.rectangle(img, (x1, y1 - text_h - 4), (x1 + text_w, y1), color, -1)
         cv2.putText(img, label_text, (x1, y1 - 2), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
@@ -75,60 +121,150 @@ def draw_boxes(image: np.ndarray, labels: List[Tuple],
     return img
 
 
-def validate_dataset(data_dir: Path, verbose: bool = True) -> dict:
-    """Validate YOLO format dataset and return statistics."""
-    stats = {
-        'train': {'images': 0, 'labels': 0, 'boxes': 0, 'errors': []},
-        'val': {'images': 0, 'labels': 0, 'boxes': 0, 'errors': []},
-        'test': {'images': 0, 'labels': 0, 'boxes': 0, 'errors': []},
+def _validate_one(img_path: str, images_dir: Path,
+                  labels_dir: Path) -> Tuple[Optional[np.ndarray], List[str]]:
+    """Load and validate a single image's label file, returning (labels, errors)."""
+    stem = file_key(img_path, images_dir)
+    label_path = os.path.join(labels_dir, f"{stem}.txt")
+    
+    # One open+read per file; a missing label surfaces as FileNotFoundError instead of an extra stat
+    try:
+        with open(label_path, 'rb') as f:
+            labels = parse_yolo_labels(f.read())
+    except FileNotFoundError:
+        return None, [f"{stem}: Missing label file"]
+    
+    coords = labels[:, 1:]
+    
+    # Validate label values: one vectorized mask per check, strings only for offending boxes
+    bad_bounds = ((coords < 0) | (coords > 1)).any(axis=1)
+    bad_size = (coords[:, 2:] <= 0).any(axis=1)
+    if not (bad_bounds | bad_size).any():
+        return labels, []
+    
+    errors = [f"{stem}: Invalid coordinates (box {i})" for i in np.flatnonzero(bad_bounds)] + \
+             [f"{stem}: Zero-size box (box {i})" for i in np.flatnonzero(bad_size)]
+    
+    return labels, errors
+
+
+def summarize_box_sizes(labels: np.ndarray) -> dict:
+    """Min/max/mean of box width, height, area and aspect ratio."""
+    if len(labels) == 0:
+        return {}
+    
+    widths = labels[:, 3].astype(np.float64)
+    heights = labels[:, 4].astype(np.float64)
+    metrics = {
+        'width': widths,
+        'height': heights,
+        'area': widths * heights,
+        'aspect_ratio': widths[heights > 0] / heights[heights > 0],
+    }
+    
+    return {
+        name: {'min': values.min(), 'max': values.max(), 'mean': values.mean()}
+        for name, values in metrics.items() if len(values)
     }
+
+
+def scan_labels(data_dir: Path, verbose: bool = True) -> dict:
+    """
+    Read every split's label files once and collect all dataset statistics.
+    
+    Returns per-split counts and errors, plus the class distribution
+    ('classes') and box size summary ('box_sizes') of the loaded labels.
+    """
+    stats = {}
     
     for split in ['train', 'val', 'test']:
+        stats[split] = {'images': 0, 'labels': 0, 'boxes': 0, 'errors': [],
+                        'classes': {}, 'box_sizes': {}, 'found': False}
         images_dir = data_dir / 'images' / split
         labels_dir = data_dir / 'labels' / split
         
         if not images_dir.exists():
-            if verbose:
-                print(f"⚠️  {split}: images directory not found")
             continue
         
-        image_files = list(images_dir.glob('*.jpg')) + \
-                     list(images_dir.glob('*.png')) + \
-                     list(images_dir.glob('*.jpeg'))
-        
+        image_files = list_files(images_dir, IMAGE_EXTENSIONS)
         stats[split]['images'] = len(image_files)
+        stats[split]['found'] = True
+        split_labels = []
+        
+        # Per-image work is stat/IO bound, so threads overlap it well
+        worker = partial(_validate_one, images_dir=images_dir, labels_dir=labels_dir)
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for labels, errors in tqdm(
+                executor.map(worker, image_files),
+                total=len(image_files), desc=f"Validating {split}", disable=not verbose
+            ):
+                stats[split]['errors'].extend(errors)
+                if labels is not None:
+                    stats[split]['labels'] += 1
+                    split_labels.append(labels)
         
-        for img_path in tqdm(image_files, desc=f"Validating {split}", disable=not verbose):
-            label_path = labels_dir / f"{img_path.stem}.txt"
-            
-            if label_path.exists():
-                stats[split]['labels'] += 1
-                labels = load_yolo_labels(label_path)
-                stats[split]['boxes'] += len(labels)
-                
-                # Validate label values
-                for label in labels:
-                    cls, x, y, w, h = label
-                    if not (0 <= x <= 1 and 0 <= y <= 1 and 0 <= w <= 1 and 0 <= h <= 1):
-                        stats[split]['errors'].append(f"{img_path.stem}: Invalid coordinates")
-                    if w <= 0 or h <= 0:
-                        stats[split]['errors'].append(f"{img_path.stem}: Zero-size box")
-            else:
-                stats[split]['errors'].append(f"{img_path.stem}: Missing label file")
+        labels = np.concatenate(split_labels) if split_labels else np.empty((0, 5), np.float32)
+        classes, counts = np.unique(labels[:, 0].astype(int), return_counts=True)
+        stats[split]['boxes'] = len(labels)
+        stats[split]['classes'] = dict(zip(classes.tolist(), counts.tolist()))
+        stats[split]['box_sizes'] = summarize_box_sizes(labels)
+    
+    return stats
+
+
+def validate_dataset(data_dir: Path, verbose: bool = True) -> dict:
+    """Validate YOLO format dataset and return statistics."""
+    stats = scan_labels(data_dir, verbose)
+    
+    for split, split_stats in stats.items():
+        if not verbose:
+            continue
+        if not split_stats['found']:
+            print(f"⚠️  {split}: images directory not found")
+            continue
         
-        if verbose:
-            print(f"\n{split.upper()}:")
-            print(f"  Images: {stats[split]['images']}")
-            print(f"  Labels: {stats[split]['labels']}")
-            print(f"  Total boxes: {stats[split]['boxes']}")
-            if stats[split]['images'] > 0:
-                print(f"  Avg boxes/image: {stats[split]['boxes'] / stats[split]['images']:.2f}")
-            if stats[split]['errors']:
-                print(f"  ⚠️  Errors: {len(stats[split]['errors'])}")
+        print(f"\n{split.upper()}:")
+        print(f"  Images: {split_stats['images']}")
+        print(f"  Labels: {split_stats['labels']}")
+        print(f"  Total boxes: {split_stats['boxes']}")
+        if split_stats['images'] > 0:
+            print(f"  Avg boxes/image: {split_stats['boxes'] / split_stats['images']:.2f}")
+        if split_stats['errors']:
+            print(f"  ⚠️  Errors: {len(split_stats['errors'])}")
     
     return stats
 
 
+def build_mosaic(images: List[np.ndarray], titles: List[str], header: str,
+                 cols: int = 3, tile_size: int = 640) -> np.ndarray:
+    """Letterbox images into a white uint8 grid with a title strip per tile and a header."""
+    title_h, header_h = 40, 56
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    rows = (len(images) + cols - 1) // cols
+    cell_h = title_h + tile_size
+    
+    mosaic = np.full((header_h + rows * cell_h, cols * tile_size, 3), 255, dtype=np.uint8)
+    (text_w, _), _ = cv2.getTextSize(header, font, 0.9, 2)
+    cv2.putText(mosaic, header, ((mosaic.shape[1] - text_w) // 2, 38), font, 0.9, (0, 0, 0), 2)
+    
+    for idx, (img, title) in enumerate(zip(images, titles)):
+        row, col = idx // cols, idx % cols
+        y0, x0 = header_h + row * cell_h, col * tile_size
+        
+        h, w = img.shape[:2]
+        scale = min(tile_size / w, tile_size / h)
+        new_w, new_h = max(1, round(w * scale)), max(1, round(h * scale))
+        interp = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        tile = cv2.resize(img, (new_w, new_h), interpolation=interp)
+        
+        ty = y0 + title_h + (tile_size - new_h) // 2
+        tx = x0 + (tile_size - new_w) // 2
+        mosaic[ty:ty + new_h, tx:tx + new_w] = tile
+        cv2.putText(mosaic, title, (x0 + 8, y0 + 28), font, 0.6, (0, 0, 0), 1, cv2.LINE_AA)
+    
+    return mosaic
+
+
 def visualize_samples(data_dir: Path, num_samples: int = 9, 
                      split: str = 'train', save_path: Optional[Path] = None):
     """Visualize random samples with bounding boxes."""
@@ -139,15 +275,14 @@ def visualize_samples(data_dir: Path, num_samples: int = 9,
     data_yaml = data_dir / 'data.yaml'
     class_names = {0: 'handwriting'}
     if data_yaml.exists():
+        import yaml
         with open(data_yaml, 'r') as f:
             config = yaml.safe_load(f)
             if 'names' in config:
                 class_names = config['names']
     
     # Get image files
-    image_files = list(images_dir.glob('*.jpg')) + \
-                 list(images_dir.glob('*.png')) + \
-                 list(images_dir.glob('*.jpeg'))
+    image_files = list_files(images_dir, IMAGE_EXTENSIONS) if images_dir.is_dir() else []
     
     if not image_files:
         print(f"No images found in {images_dir}")
@@ -156,103 +291,61 @@ def visualize_samples(data_dir: Path, num_samples: int = 9,
     # Random sample
     samples = random.sample(image_files, min(num_samples, len(image_files)))
     
-    # Create grid
-    cols = min(3, len(samples))
-    rows = (len(samples) + cols - 1) // cols
-    
-    fig, axes = plt.subplots(rows, cols, figsize=(5*cols, 5*rows))
-    if rows == 1 and cols == 1:
-        axes = [[axes]]
-    elif rows == 1:
-        axes = [axes]
-    elif cols == 1:
-        axes = [[ax] for ax in axes]
-    
-    for idx, img_path in enumerate(samples):
-        row, col = idx // cols, idx % cols
-        ax = axes[row][col]
-        
-        # Load image
-        img = cv2.imread(str(img_path))
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    images, titles = [], []
+    for img_path in samples:
+        # Load image (np.fromfile also copes with non-ASCII paths on Windows)
+        stem = file_key(img_path, images_dir)
+        img = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
         
         # Load and draw labels
-        label_path = labels_dir / f"{img_path.stem}.txt"
-        labels = load_yolo_labels(label_path)
-        
-        img_with_boxes = draw_boxes(img, labels, class_names)
+        labels = load_yolo_labels(os.path.join(labels_dir, f"{stem}.txt"))
         
-        ax.imshow(img_with_boxes)
-        ax.set_title(f"{img_path.stem}\n{len(labels)} boxes", fontsize=8)
-        ax.axis('off')
-    
-    # Hide empty axes
-    for idx in range(len(samples), rows * cols):
-        row, col = idx // cols, idx % cols
-        axes[row][col].axis('off')
+        images.append(draw_boxes(img, labels, class_names, inplace=True))
+        titles.append(f"{stem} - {len(labels)} boxes")
     
-    plt.suptitle(f"Dataset Samples ({split})", fontsize=14)
-    plt.tight_layout()
+    cols = min(3, len(samples))
+    header = f"Dataset Samples ({split})"
     
+    # Saving: compose the grid directly in uint8, no matplotlib figure needed
     if save_path:
-        plt.savefig(save_path, dpi=150, bbox_inches='tight')
+        mosaic = build_mosaic(images, titles, header, cols)
+        cv2.imwrite(str(save_path), cv2.cvtColor(mosaic, cv2.COLOR_RGB2BGR))
         print(f"Saved visualization to {save_path}")
+        return
+    
+    # Interactive display; imported here so other runs skip matplotlib's backend setup
+    import matplotlib.pyplot as plt
+    
+    rows = (len(samples) + cols - 1) // cols
+    fig, axes = plt.subplots(rows, cols, figsize=(5*cols, 5*rows), squeeze=False)
+    
+    for idx, ax in enumerate(axes.flat):
+        ax.axis('off')
+        if idx < len(images):
+            ax.imshow(images[idx])
+            ax.set_title(titles[idx].replace(' - ', '\n'), fontsize=8)
     
+    plt.suptitle(header, fontsize=14)
+    plt.tight_layout()
     plt.show()
 
 
-def check_class_distribution(data_dir: Path) -> dict:
+def check_class_distribution(data_dir: Path, stats: Optional[dict] = None) -> dict:
     """Check class distribution in dataset."""
-    distribution = {}
+    if stats is None:
+        stats = scan_labels(data_dir, verbose=False)
     
-    for split in ['train', 'val']:
-        labels_dir = data_dir / 'labels' / split
-        if not labels_dir.exists():
-            continue
-        
-        split_dist = {}
-        for label_file in labels_dir.glob('*.txt'):
-            labels = load_yolo_labels(label_file)
-            for label in labels:
-                cls = label[0]
-                split_dist[cls] = split_dist.get(cls, 0) + 1
-        
-        distribution[split] = split_dist
-    
-    return distribution
+    return {split: stats[split]['classes'] for split in ['train', 'val']
+            if (data_dir / 'labels' / split).exists()}
 
 
-def check_box_sizes(data_dir: Path, split: str = 'train') -> dict:
+def check_box_sizes(data_dir: Path, split: str = 'train', stats: Optional[dict] = None) -> dict:
     """Analyze bounding box size distribution."""
-    widths = []
-    heights = []
-    areas = []
-    aspect_ratios = []
-    
-    labels_dir = data_dir / 'labels' / split
-    if not labels_dir.exists():
-        return {}
+    if stats is None:
+        stats = scan_labels(data_dir, verbose=False)
     
-    for label_file in labels_dir.glob('*.txt'):
-        labels = load_yolo_labels(label_file)
-        for label in labels:
-            _, _, _, w, h = label
-            widths.append(w)
-            heights.append(h)
-            areas.append(w * h)
-            if h > 0:
-                aspect_ratios.append(w / h)
-    
-    if not widths:
-        return {}
-    
-    return {
-        'width': {'min': min(widths), 'max': max(widths), 'mean': np.mean(widths)},
-        'height': {'min': min(heights), 'max': max(heights), 'mean': np.mean(heights)},
-        'area': {'min': min(areas), 'max': max(areas), 'mean': np.mean(areas)},
-        'aspect_ratio': {'min': min(aspect_ratios), 'max': max(aspect_ratios), 
-                        'mean': np.mean(aspect_ratios)},
-    }
+    return stats[split]['box_sizes']
 
 
 def main():
@@ -290,7 +383,7 @@ def main():
     print("\n" + "="*60)
     print(" Class Distribution")
     print("="*60)
-    distribution = check_class_distribution(data_dir)
+    distribution = check_class_distribution(data_dir, stats)
     for split, dist in distribution.items():
         print(f"\n{split}:")
         for cls, count in sorted(dist.items()):
@@ -301,7 +394,7 @@ def main():
         print("\n" + "="*60)
         print(" Bounding Box Statistics")
         print("="*60)
-        size_stats = check_box_sizes(data_dir, args.split)
+        size_stats = check_box_sizes(data_dir, args.split, stats)
         for metric, values in size_stats.items():
             print(f"\n{metric}:")
             for stat, val in values.items():
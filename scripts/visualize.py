@@ -7,13 +7,15 @@ import os
 import sys
 import json
 import argparse
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import TYPE_CHECKING, Dict, List, Tuple, Optional
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import patches
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
 
 
 # Color palette for visualization
@@ -25,6 +27,7 @@ COLORS = [
     (255, 0, 255),  # Magenta
     (0, 255, 255),  # Yellow
 ]
+COLORS_ARR = np.asarray(COLORS, dtype=np.uint8)
 
 
 def get_color(idx: int) -> Tuple[int, int, int]:
@@ -32,6 +35,112 @@ def get_color(idx: int) -> Tuple[int, int, int]:
     return COLORS[idx % len(COLORS)]
 
 
+def build_color_map(ids) -> Dict[int, Tuple[int, int, int]]:
+    """Resolve the palette color of each distinct id once."""
+    return {i: tuple(int(c) for c in COLORS_ARR[i % len(COLORS_ARR)]) for i in set(ids)}
+
+
+@lru_cache(maxsize=4096)
+def text_size(label: str, font_scale: float, thickness: int) -> Tuple[Tuple[int, int], int]:
+    """cv2.getTextSize for FONT_HERSHEY_SIMPLEX, memoized: label strings repeat across boxes."""
+    return cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+
+
+def label_layout(
+    image_height: int,
+    box: List[int],
+    label: str,
+    label_position: str = 'top',  # 'top' or 'bottom'
+) -> Tuple[Tuple[int, int, int, int], Tuple[int, int]]:
+    """Background rectangle (x1, y1, x2, y2) and text origin of a label tag."""
+    x1, y1, x2, y2 = box
+    (text_w, text_h), baseline = text_size(label, 0.5, 1)
+    
+    if label_position == 'top':
+        label_y1 = max(0, y1 - text_h - 4)
+        label_y2 = y1
+        text_y = y1 - 2
+    else:
+        label_y1 = y2
+        label_y2 = min(image_height, y2 + text_h + 4)
+        text_y = y2 + text_h + 2
+    
+    return (x1, label_y1, x1 + text_w + 4, label_y2), (x1 + 2, text_y)
+
+
+def draw_label(
+    image: np.ndarray,
+    box: List[int],
+    label: str,
+    color: Tuple[int, int, int] = (0, 255, 0),
+    label_position: str = 'top',  # 'top' or 'bottom'
+) -> np.ndarray:
+    """Draw a filled label tag above or below a box."""
+    (bx1, by1, bx2, by2), text_org = label_layout(image.shape[0], box, label, label_position)
+    
+    # Background rectangle
+    cv2.rectangle(image, (bx1, by1), (bx2, by2), color, -1)
+    
+    # Text
+    cv2.putText(
+        image,
+        label,
+        text_org,
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.5,
+        (255, 255, 255),
+        1,
+    )
+    
+    return image
+
+
+def rects_overlap(rects: np.ndarray) -> bool:
+    """Whether any two inclusive (x1, y1, x2, y2) rectangles touch or overlap."""
+    if len(rects) < 2:
+        return False
+    x1, y1, x2, y2 = rects.T
+    hit = ((x1[:, None] <= x2[None, :]) & (x1[None, :] <= x2[:, None]) &
+           (y1[:, None] <= y2[None, :]) & (y1[None, :] <= y2[:, None]))
+    np.fill_diagonal(hit, False)
+    return bool(hit.any())
+
+
+def draw_labels(image: np.ndarray, labels: List[Tuple]) -> np.ndarray:
+    """
+    Draw (box, label, color, position) tags in order.
+    
+    Backgrounds are filled with one fillPoly call per color when no two
+    tags touch. fillPoly uses even-odd filling, so overlapping quads would
+    punch holes, and overlapping tags must also keep their draw order;
+    those fall back to drawing each tag in turn.
+    """
+    if not labels:
+        return image
+    
+    layouts = [label_layout(image.shape[0], box, label, position)
+               for box, label, _, position in labels]
+    rects = np.array([rect for rect, _ in layouts], dtype=np.int32)
+    
+    if rects_overlap(rects):
+        for box, label, color, position in labels:
+            draw_label(image, box, label, color, position)
+        return image
+    
+    quads = rects[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+    by_color = {}
+    for i, (_, _, color, _) in enumerate(labels):
+        by_color.setdefault(color, []).append(i)
+    for color, idx in by_color.items():
+        cv2.fillPoly(image, list(quads[idx]), color)
+    
+    # OpenCV has no batched putText
+    for (_, label, _, _), (_, text_org) in zip(labels, layouts):
+        cv2.putText(image, label, text_org, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    
+    return image
+
+
 def draw_box(
     image: np.ndarray,
     box: List[int],
@@ -48,42 +157,7 @@ def draw_box(
     
     # Draw label
     if label:
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        font_scale = 0.5
-        font_thickness = 1
-        
-        (text_w, text_h), baseline = cv2.getTextSize(
-            label, font, font_scale, font_thickness
-        )
-        
-        if label_position == 'top':
-            label_y1 = max(0, y1 - text_h - 4)
-            label_y2 = y1
-            text_y = y1 - 2
-        else:
-            label_y1 = y2
-            label_y2 = min(image.shape[0], y2 + text_h + 4)
-            text_y = y2 + text_h + 2
-        
-        # Background rectangle
-        cv2.rectangle(
-            image,
-            (x1, label_y1),
-            (x1 + text_w + 4, label_y2),
-            color,
-            -1
-        )
-        
-        # Text
-        cv2.putText(
-            image,
-            label,
-            (x1 + 2, text_y),
-            font,
-            font_scale,
-            (255, 255, 255),
-            font_thickness,
-        )
+        draw_label(image, box, label, color, label_position)
     
     return image
 
@@ -95,6 +169,7 @@ def draw_detections(
     show_id: bool = True,
     show_ocr: bool = True,
     color_by_line: bool = True,
+    inplace: bool = False,
 ) -> np.ndarray:
     """
     Draw all detections on image.
@@ -106,21 +181,24 @@ def draw_detections(
         show_id: Show detection IDs
         show_ocr: Show OCR text
         color_by_line: Color boxes by line ID
+        inplace: Draw on the input image instead of a copy
     """
-    img = image.copy()
+    img = image if inplace else image.copy()
+    
+    color_key = 'line_id' if color_by_line else 'id'
+    color_map = build_color_map(det.get(color_key, 0) for det in detections)
     
+    # Box outlines: one polylines call per color instead of a rectangle call per box
+    outlines = {}
+    labels = []
     for det in detections:
-        box = det['box']
+        x1, y1, x2, y2 = box = det['box']
         conf = det.get('confidence', 0)
         det_id = det.get('id', 0)
-        line_id = det.get('line_id', 0)
         ocr_text = det.get('ocr_text', '')
+        color = color_map[det.get(color_key, 0)]
         
-        # Choose color
-        if color_by_line:
-            color = get_color(line_id)
-        else:
-            color = get_color(det_id)
+        outlines.setdefault(color, []).append([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
         
         # Build label
         label_parts = []
@@ -129,14 +207,18 @@ def draw_detections(
         if show_confidence:
             label_parts.append(f"{conf:.2f}")
         
-        top_label = " ".join(label_parts) if label_parts else None
+        if label_parts:
+            labels.append((box, " ".join(label_parts), color, 'top'))
         
-        # Draw box with top label
-        draw_box(img, box, color, 2, top_label, 'top')
-        
-        # Draw OCR text below
+        # OCR text below
         if show_ocr and ocr_text:
-            draw_box(img, box, color, 0, ocr_text[:30], 'bottom')
+            labels.append((box, ocr_text[:30], color, 'bottom'))
+    
+    for color, polys in outlines.items():
+        cv2.polylines(img, list(np.array(polys, dtype=np.int32)), True, color, 2, cv2.LINE_8)
+    
+    # Labels in a second pass, on top of every outline
+    draw_labels(img, labels)
     
     return img
 
@@ -145,43 +227,36 @@ def draw_lines(
     image: np.ndarray,
     detections: List[Dict],
     connect_lines: bool = True,
+    inplace: bool = False,
 ) -> np.ndarray:
-    """Draw line connections between boxes."""
-    img = image.copy()
-    
-    # Group by line
-    lines = {}
-    for det in detections:
-        line_id = det.get('line_id', 0)
-        if line_id not in lines:
-            lines[line_id] = []
-        lines[line_id].append(det)
-    
-    # Sort boxes in each line
-    for line_id in lines:
-        lines[line_id].sort(key=lambda d: d['box'][0])
-    
-    # Draw connections
-    if connect_lines:
-        for line_id, line_dets in lines.items():
-            color = get_color(line_id)
-            
-            for i in range(len(line_dets) - 1):
-                box1 = line_dets[i]['box']
-                box2 = line_dets[i + 1]['box']
-                
-                # Connect right edge of box1 to left edge of box2
-                center_y1 = (box1[1] + box1[3]) // 2
-                center_y2 = (box2[1] + box2[3]) // 2
-                
-                cv2.line(
-                    img,
-                    (box1[2], center_y1),
-                    (box2[0], center_y2),
-                    color,
-                    1,
-                    cv2.LINE_AA
-                )
+    """Draw line connections between boxes (on a copy unless inplace=True)."""
+    img = image if inplace else image.copy()
+    
+    if not connect_lines or not detections:
+        return img
+    
+    # Sort by line, then left to right, with one stable lexsort
+    line_ids = np.fromiter((d.get('line_id', 0) for d in detections), dtype=np.int64,
+                           count=len(detections))
+    boxes = np.array([d['box'] for d in detections], dtype=np.int64).reshape(-1, 4)
+    order = np.lexsort((boxes[:, 0], line_ids))
+    sorted_ids = line_ids[order]
+    sorted_boxes = boxes[order]
+    
+    # Connect right edge of each box to left edge of the next box on the same line
+    same_line = sorted_ids[1:] == sorted_ids[:-1]
+    left, right = sorted_boxes[:-1][same_line], sorted_boxes[1:][same_line]
+    segment_ids = sorted_ids[:-1][same_line]
+    segments = np.stack([
+        np.stack([left[:, 2], (left[:, 1] + left[:, 3]) // 2], axis=1),
+        np.stack([right[:, 0], (right[:, 1] + right[:, 3]) // 2], axis=1),
+    ], axis=1).astype(np.int32)  # (M, 2, 2)
+    
+    # Draw connections: one polylines call per line, each segment its own 2-point polyline
+    color_map = build_color_map(segment_ids.tolist())
+    for line_id in np.unique(segment_ids).tolist():
+        cv2.polylines(img, list(segments[segment_ids == line_id]), False,
+                      color_map[line_id], 1, cv2.LINE_AA)
     
     return img
 
@@ -207,26 +282,28 @@ def draw_results(
         show_lines: Draw line connections
         show_text_box: Show aggregated text box
     """
+    # Single copy up front; every layer below draws into it in place
     img = image.copy()
     detections = result.get('detections', [])
     
     # Draw detections
-    img = draw_detections(
+    draw_detections(
         img, detections,
         show_confidence=show_confidence,
         show_id=show_id,
         show_ocr=show_ocr,
+        inplace=True,
     )
     
     # Draw line connections
     if show_lines:
-        img = draw_lines(img, detections)
+        draw_lines(img, detections, inplace=True)
     
     # Draw text box
     if show_text_box:
         text = result.get('aggregated_text', '')
         if text:
-            img = draw_text_box(img, text)
+            draw_text_box(img, text, inplace=True)
     
     return img
 
@@ -238,9 +315,10 @@ def draw_text_box(
     max_width: int = None,
     font_scale: float = 0.6,
     padding: int = 10,
+    inplace: bool = False,
 ) -> np.ndarray:
-    """Draw a text box with recognized text."""
-    img = image.copy()
+    """Draw a text box with recognized text (on a copy unless inplace=True)."""
+    img = image if inplace else image.copy()
     h, w = img.shape[:2]
     max_width = max_width or w
     
@@ -252,12 +330,9 @@ def draw_text_box(
     line_height = int(25 * font_scale)
     
     # Wrap long lines
-    wrapped_lines = []
-    for line in lines:
-        while len(line) > 60:
-            wrapped_lines.append(line[:60])
-            line = line[60:]
-        wrapped_lines.append(line)
+    wrapped_lines = [
+        line[i:i + 60] for line in lines for i in range(0, max(len(line), 1), 60)
+    ]
     
     # Calculate box size
     box_height = len(wrapped_lines) * line_height + 2 * padding
@@ -269,15 +344,10 @@ def draw_text_box(
     else:
         y_start = 0
     
-    overlay = img.copy()
-    cv2.rectangle(
-        overlay,
-        (0, y_start),
-        (box_width, y_start + box_height),
-        (0, 0, 0),
-        -1
-    )
-    img = cv2.addWeighted(overlay, 0.7, img, 0.3, 0)
+    # Blend only the rows under the box; the rest of the image is untouched
+    y0, y1 = max(0, y_start), min(h, y_start + box_height + 1)
+    roi = img[y0:y1, :box_width]
+    cv2.addWeighted(np.zeros_like(roi), 0.7, roi, 0.3, 0, dst=roi)
     
     # Draw text
     y = y_start + padding + line_height
@@ -301,18 +371,29 @@ def create_comparison_figure(
     original: np.ndarray,
     result: Dict,
     figsize: Tuple[int, int] = (16, 8),
-) -> plt.Figure:
+    annotated: Optional[np.ndarray] = None,
+) -> 'Figure':
     """Create a matplotlib figure comparing original and annotated images."""
+    # Imported here so save-only runs skip matplotlib's backend and font setup
+    import matplotlib.pyplot as plt
+    
+    # Reuse the caller's rendering instead of drawing every layer again
+    if annotated is None:
+        annotated = draw_results(original, result)
+    
+    # One BGR->RGB pass over both images; each axis shows a view of its half
+    w = original.shape[1]
+    combined = cv2.cvtColor(np.hstack([original, annotated]), cv2.COLOR_BGR2RGB)
+    
     fig, axes = plt.subplots(1, 2, figsize=figsize)
     
     # Original
-    axes[0].imshow(cv2.cvtColor(original, cv2.COLOR_BGR2RGB))
+    axes[0].imshow(combined[:, :w])
     axes[0].set_title('Original Image')
     axes[0].axis('off')
     
     # Annotated
-    annotated = draw_results(original, result)
-    axes[1].imshow(cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB))
+    axes[1].imshow(combined[:, w:])
     axes[1].set_title(f"Detected: {result.get('num_detections', 0)} regions")
     axes[1].axis('off')
     
@@ -351,7 +432,8 @@ def visualize_json_file(
     
     # Show
     if show:
-        fig = create_comparison_figure(image, result)
+        import matplotlib.pyplot as plt
+        fig = create_comparison_figure(image, result, annotated=annotated)
         plt.show()
 
 
@@ -428,7 +510,8 @@ def main():
     
     # Show
     if not args.no_show:
-        fig = create_comparison_figure(image, result)
+        import matplotlib.pyplot as plt
+        fig = create_comparison_figure(image, result, annotated=annotated)
         plt.show()
 
 
@@ -6,14 +6,18 @@ Converts typed text to realistic handwritten SVG images
 import base64
 import io
 import os
+import re
 import sys
-import tempfile
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
+import anyio
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel, Field, field_validator
 
 # Get the ref2 directory path
@@ -25,10 +29,23 @@ os.chdir(REF2_PATH)
 # Add ref2 to path for handwriting_synthesis import
 sys.path.insert(0, str(REF2_PATH))
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the model (and run one sample) before serving, unless LAZY_LOAD_MODEL=1"""
+    if os.environ.get("LAZY_LOAD_MODEL") != "1":
+        # A throwaway sample builds the TF graph, so the first real request is steady-state
+        await anyio.to_thread.run_sync(render_svg, "warm up", 9, 0.75, "black", 2)
+    yield
+
+
 app = FastAPI(
     title="Handwriting Synthesis API",
     description="Generate realistic handwritten text from typed input",
     version="1.0.0",
+    # SVG payloads run to hundreds of KB; orjson serializes them far faster than json
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # CORS configuration
@@ -41,7 +58,7 @@ app.add_middleware(
 )
 
 # Valid characters for handwriting synthesis
-VALID_CHARS = set(
+VALID_CHARS = frozenset(
     [
         "\x00",
         " ",
@@ -119,24 +136,71 @@ VALID_CHARS = set(
     ]
 )
 
+# Matches any character outside VALID_CHARS; search() stops at the first one
+_INVALID_RE = re.compile(f"[^{re.escape(''.join(sorted(VALID_CHARS)))}]")
+
 MAX_CHARS_PER_LINE = 75
 MAX_LINES = 20
 VALID_STYLES = list(range(13))  # 0-12
+SVG_CACHE_SIZE = 512
 
 # Lazy load the Hand model (heavy TensorFlow model)
 _hand_instance = None
+_hand_lock = threading.Lock()
 
 
 def get_hand():
     """Lazy load the Hand instance to avoid loading TensorFlow on import"""
     global _hand_instance
     if _hand_instance is None:
-        from handwriting_synthesis import Hand
+        # Requests render on worker threads; only the first one may build the model
+        with _hand_lock:
+            if _hand_instance is None:
+                from handwriting_synthesis import Hand
 
-        _hand_instance = Hand()
+                _hand_instance = Hand()
     return _hand_instance
 
 
+def render_svg(text: str, style: int, bias: float, stroke_color: str, stroke_width: int) -> str:
+    """Run the (blocking) Hand model on text and return the SVG markup"""
+    hand = get_hand()
+
+    # Split text into lines
+    lines = text.split("\n")
+
+    # Prepare parameters for each line
+    # The library handles empty strings for line spacing
+    biases = [bias] * len(lines)
+    styles = [style] * len(lines)
+    stroke_colors = [stroke_color] * len(lines)
+    stroke_widths = [stroke_width] * len(lines)
+
+    # Generate SVG in memory (no temp file round-trip)
+    svg_buffer = io.StringIO()
+    hand.write(
+        filename=svg_buffer,
+        lines=lines,
+        biases=biases,
+        styles=styles,
+        stroke_colors=stroke_colors,
+        stroke_widths=stroke_widths,
+    )
+    return svg_buffer.getvalue()
+
+
+@lru_cache(maxsize=SVG_CACHE_SIZE)
+def render_svg_cached(
+    text: str, style: int, bias: float, stroke_color: str, stroke_width: int, cache_key: str
+) -> str:
+    """
+    Memoized render_svg. Sampling is stochastic, so the caller's cache_key is part
+    of the key: the first sample drawn for a (parameters, cache_key) pair is reused
+    for repeats. The cache is per process and does not survive restarts or eviction
+    """
+    return render_svg(text, style, bias, stroke_color, stroke_width)
+
+
 class SynthesisRequest(BaseModel):
     """Request model for handwriting synthesis"""
 
@@ -147,6 +211,16 @@ class SynthesisRequest(BaseModel):
     )
     stroke_color: str = Field(default="black", description="Stroke color (CSS color name or hex)")
     stroke_width: int = Field(default=2, ge=1, le=5, description="Stroke width in pixels")
+    cache_key: Optional[str] = Field(
+        default=None,
+        max_length=64,
+        description="Identical requests with the same cache_key reuse the sample drawn "
+        "first, while it stays in this server process's cache (not a sampling seed: "
+        "a restart or eviction draws a new one). Omit to always draw a fresh sample",
+    )
+    include_base64: bool = Field(
+        default=False, description="Also return the SVG base64 encoded in `svg`"
+    )
 
     @field_validator("text")
     @classmethod
@@ -162,10 +236,10 @@ class SynthesisRequest(BaseModel):
             if len(line) > MAX_CHARS_PER_LINE:
                 raise ValueError(f"Line {i + 1} exceeds {MAX_CHARS_PER_LINE} characters")
 
-            invalid_chars = [c for c in line if c not in VALID_CHARS]
-            if invalid_chars:
+            if _INVALID_RE.search(line):
+                invalid_chars = set(line) - VALID_CHARS
                 raise ValueError(
-                    f"Invalid characters in line {i + 1}: {invalid_chars}. "
+                    f"Invalid characters in line {i + 1}: {sorted(invalid_chars)}. "
                     f"Note: Q, X, Z are not supported."
                 )
 
@@ -175,7 +249,9 @@ class SynthesisRequest(BaseModel):
 class SynthesisResponse(BaseModel):
     """Response model for handwriting synthesis"""
 
-    svg: str = Field(..., description="Base64 encoded SVG content")
+    svg: Optional[str] = Field(
+        default=None, description="Base64 encoded SVG content (only if include_base64)"
+    )
     svg_raw: str = Field(..., description="Raw SVG content")
     lines_count: int = Field(..., description="Number of lines generated")
     characters_count: int = Field(..., description="Total characters processed")
@@ -240,6 +316,22 @@ async def get_styles():
     return styles
 
 
+async def render_request(request: SynthesisRequest) -> str:
+    """Render a request's SVG on a worker thread, via the cache when a cache_key is set"""
+    params = (
+        request.text,
+        request.style,
+        request.bias,
+        request.stroke_color,
+        request.stroke_width,
+    )
+
+    # TensorFlow sampling blocks for seconds; keep it off the event loop
+    if request.cache_key is None:
+        return await anyio.to_thread.run_sync(render_svg, *params)
+    return await anyio.to_thread.run_sync(render_svg_cached, *params, request.cache_key)
+
+
 @app.post("/synthesize", response_model=SynthesisResponse)
 async def synthesize_handwriting(request: SynthesisRequest):
     """
@@ -250,46 +342,17 @@ async def synthesize_handwriting(request: SynthesisRequest):
     - **bias**: Neatness (0=sloppy, 0.75=default, 1+=very neat)
     - **stroke_color**: CSS color for the handwriting
     - **stroke_width**: Thickness of strokes (1-5)
+    - **cache_key**: Optional; repeats with the same key are served from this process's cache
+    - **include_base64**: Also return a base64 copy of the SVG in `svg`
     """
     try:
-        hand = get_hand()
-
-        # Split text into lines
+        svg_content = await render_request(request)
         lines = request.text.split("\n")
 
-        # Filter out empty lines but keep track of them for spacing
-        # The library handles empty strings for line spacing
-
-        # Prepare parameters for each line
-        biases = [request.bias] * len(lines)
-        styles = [request.style] * len(lines)
-        stroke_colors = [request.stroke_color] * len(lines)
-        stroke_widths = [request.stroke_width] * len(lines)
-
-        # Generate SVG to a temporary file
-        with tempfile.NamedTemporaryFile(suffix=".svg", delete=False) as tmp:
-            tmp_path = tmp.name
-
-        try:
-            hand.write(
-                filename=tmp_path,
-                lines=lines,
-                biases=biases,
-                styles=styles,
-                stroke_colors=stroke_colors,
-                stroke_widths=stroke_widths,
-            )
-
-            # Read the generated SVG
-            with open(tmp_path, "r", encoding="utf-8") as f:
-                svg_content = f.read()
-        finally:
-            # Clean up temp file
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
-
-        # Encode to base64
-        svg_base64 = base64.b64encode(svg_content.encode("utf-8")).decode("utf-8")
+        # Base64 duplicates the payload, so only encode it on request
+        svg_base64 = None
+        if request.include_base64:
+            svg_base64 = base64.b64encode(svg_content.encode("utf-8")).decode("utf-8")
 
         return SynthesisResponse(
             svg=svg_base64,
@@ -313,14 +376,14 @@ async def synthesize_svg_direct(request: SynthesisRequest):
     Use this endpoint for direct SVG downloads
     """
     try:
-        response = await synthesize_handwriting(request)
+        svg_content = await render_request(request)
         return Response(
-            content=response.svg_raw,
+            content=svg_content,
             media_type="image/svg+xml",
             headers={"Content-Disposition": f"attachment; filename=handwriting.svg"},
         )
-    except HTTPException:
-        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Synthesis failed: {str(e)}")
 